@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+# --------------------- Single-Flight ---------------------
+# Identical polls arriving at several handlers at once (multiple accounts in
+# the same group, duplicated updates) share one pending answer request.
+class SingleFlight:
+    def __init__(self):
+        self._pending = {}
+        self.issued = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+            logging.info(f"🔗 Sharing in-flight answer for {key} (issued {self.issued}, coalesced {self.coalesced})")
+            return await asyncio.shield(future)
+
+        self.issued += 1
+        future = asyncio.ensure_future(fn())
+        self._pending[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._pending.get(key) is future:
+            del self._pending[key]
+        if not future.cancelled():
+            future.exception()  # mark retrieved even if every waiter went away
+
+    def stats(self):
+        return {
+            "issued": self.issued,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._pending),
+        }
+
+
+# --------------------- Content-Addressed Answer Cache ---------------------
+# Answers are keyed by the normalized question plus the *set* of options, and
+# stored as the normalized text of the correct option, so a reposted question
+# hits even when the options come back shuffled. Normalization only folds case,
+# Unicode forms and whitespace: symbols and signs carry meaning in quiz
+# options ("C" / "C++" / "C#", "5+3" / "5-3", "1" / "-1").
+_space_re = re.compile(r"\s+")
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _space_re.sub(" ", text).strip()
+
+def question_key(question, options):
+    payload = normalize_text(question) + "\x1f" + "\x1e".join(sorted(normalize_text(o) for o in options))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, db_path, max_entries=5000, ttl=30 * 86400, prune_every=500):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = prune_every  # expired rows are deleted again every N puts
+        self._puts = 0
+        self._lru = OrderedDict()  # key -> (answer_text, stored_at)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(db_path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, answer TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._prune()
+
+    def _prune(self):
+        pruned = self._db.execute("DELETE FROM answers WHERE stored_at < ?", (time.time() - self.ttl,)).rowcount
+        self._db.commit()
+        if pruned:
+            logging.info(f"🧹 Pruned {pruned} expired cached answers")
+
+    def _remember(self, key, answer, stored_at):
+        self._lru[key] = (answer, stored_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key):
+        entry = self._lru.get(key)
+        if entry is not None:
+            self._lru.move_to_end(key)
+            return entry
+        row = self._db.execute("SELECT answer, stored_at FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.disk_hits += 1
+            self._remember(key, row[0], row[1])
+            return row
+        return None
+
+    def get(self, question, options):
+        key = question_key(question, options)
+        entry = self._lookup(key)
+        if entry is not None and time.time() - entry[1] <= self.ttl:
+            answer = entry[0]
+            matches = [i for i, opt in enumerate(options) if normalize_text(opt) == answer]
+            if len(matches) == 1:  # ambiguous when several options read the same
+                self.hits += 1
+                return matches[0]
+        self.misses += 1
+        return None
+
+    def put(self, question, options, index):
+        key = question_key(question, options)
+        answer = normalize_text(options[index])
+        now = time.time()
+        self._remember(key, answer, now)
+        self._db.execute(
+            "INSERT OR REPLACE INTO answers (key, answer, stored_at) VALUES (?, ?, ?)",
+            (key, answer, now),
+        )
+        self._db.commit()
+        self._puts += 1
+        if self.prune_every and self._puts % self.prune_every == 0:
+            self._prune()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self._lru),
+        }
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,438 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+
+import config
+from answer_cache import normalize_text
+from deadlines import LatencyEstimate
+from gemini_engine import GeminiError, fetch_answer_from_gemini, fetch_scored_answer
+from metrics import (
+    current_trace, inc, observe, register_collector, register_stats, stage, unregister_collector, unregister_stats,
+)
+from prompts import batch_prompt, current_group, estimate_tokens, single_prompt, token_groups, token_usage
+
+
+class AnswerError(Exception):
+    pass
+
+
+# --------------------- Answer Engine ---------------------
+# get_poll_answer talks to an engine, not to Gemini directly. answer() returns
+# the 0-based option index, None when no valid option came back (the poll is
+# then skipped rather than guessed), and raises AnswerError when the backend
+# produced no reply at all. answer_scored() also returns the model's
+# confidence in that option (0..1), or None when the backend gives none;
+# engines implement one of the two.
+class AnswerEngine:
+    name = "base"
+    model = None
+
+    async def answer(self, question, options):
+        idx, _ = await self.answer_scored(question, options)
+        return idx
+
+    async def answer_scored(self, question, options):
+        return await self.answer(question, options), None
+
+    async def answer_batch(self, items):
+        # items: [(question, options)] -> [index or None]; engines with a real
+        # multi-question request override this
+        results = await asyncio.gather(*(self.answer(q, o) for q, o in items), return_exceptions=True)
+        return [None if isinstance(r, Exception) else r for r in results]
+
+    async def close(self):
+        pass
+
+
+def parse_option_index(reply, option_count):
+    # the reply is constrained to one option number; anything else is a miss
+    reply = (reply or "").strip().strip('"')
+    if reply.isdigit():
+        idx = int(reply) - 1
+        if 0 <= idx < option_count:
+            return idx
+    return None
+
+
+# --------------------- Gemini Engine ---------------------
+# 2.5 Pro always thinks (minimum budget 128) and rejects a budget of 0
+ALWAYS_THINKING = ("gemini-2.5-pro",)
+
+def thinking_budget(model):
+    # -> thinkingBudget to send for `model`, or None for the model default.
+    # GEMINI_THINKING_BUDGET is one value for every model or a {model: budget} dict.
+    if not config.GEMINI_ASYNC_TRANSPORT:
+        return None  # the SDK fallback cannot send thinkingConfig
+    budget = config.GEMINI_THINKING_BUDGET
+    if isinstance(budget, dict):
+        budget = budget.get(model)
+    if budget == 0 and model.startswith(ALWAYS_THINKING):
+        return None
+    return budget
+
+def limit_output(generation_config, model, max_tokens):
+    # thinking tokens count toward maxOutputTokens, so the small cap is only
+    # safe when the request turns thinking off
+    budget = thinking_budget(model)
+    if budget is not None:
+        generation_config["thinkingConfig"] = {"thinkingBudget": budget}
+    if budget == 0:
+        generation_config["maxOutputTokens"] = max_tokens
+    return generation_config
+
+
+class GeminiEngine(AnswerEngine):
+    name = "gemini"
+
+    def __init__(self, model=None, logprobs=False):
+        self.model = model or config.GEMINI_MODEL
+        # token log-probabilities give the confidence the cascade escalates on
+        self.logprobs = logprobs
+
+    def generation_config(self, option_count):
+        # enum-constrained single-token reply: the model can only emit "1".."n"
+        generation_config = {
+            "responseMimeType": "text/x.enum",
+            "responseSchema": {"type": "STRING", "enum": [str(i + 1) for i in range(option_count)]},
+            "temperature": 0,
+        }
+        if self.logprobs:
+            generation_config["responseLogprobs"] = True
+        return limit_output(generation_config, self.model, config.GEMINI_MAX_OUTPUT_TOKENS)
+
+    async def answer_scored(self, question, options):
+        prompt = single_prompt(question, options)
+        generation_config = self.generation_config(len(options))
+        for attempt in range(1 + config.GEMINI_PARSE_RETRIES):
+            try:
+                reply, confidence = await fetch_scored_answer(prompt, generation_config, self.model)
+            except GeminiError as e:
+                raise AnswerError(f"Gemini rejected the request: {e}") from e
+            if reply == "No answer":
+                raise AnswerError("Gemini returned no answer")
+            with stage("parse"):
+                idx = parse_option_index(reply, len(options))
+            if idx is not None:
+                return idx, confidence
+            inc("answer_parse_failures_total")
+            logging.warning(f"⚠️ Unparseable Gemini reply {reply[:40]!r} (attempt {attempt + 1})")
+        return None, None
+
+    async def answer_batch(self, items):
+        generation_config = {
+            "responseMimeType": "application/json",
+            "responseSchema": {"type": "ARRAY", "items": {"type": "INTEGER"}},
+            "temperature": 0,
+        }
+        limit_output(generation_config, self.model, config.GEMINI_MAX_OUTPUT_TOKENS * len(items) + 8)
+        try:
+            reply = await fetch_answer_from_gemini(batch_prompt(items), generation_config, self.model)
+        except GeminiError as e:
+            raise AnswerError(f"Gemini rejected the request: {e}") from e
+        if reply == "No answer":
+            raise AnswerError("Gemini returned no answer")
+        try:
+            numbers = json.loads(reply)
+        except ValueError:
+            numbers = None
+        if not isinstance(numbers, list) or len(numbers) != len(items):
+            inc("answer_parse_failures_total")
+            logging.warning(f"⚠️ Unparseable batch reply {reply[:60]!r}")
+            numbers = [None] * len(items)
+        results = []
+        for number, (_, options) in zip(numbers, items):
+            valid = isinstance(number, int) and 1 <= number <= len(options)
+            results.append(number - 1 if valid else None)
+        return results
+
+
+# --------------------- Local Engine ---------------------
+# Offline stand-in for load tests and benchmarks: picks a deterministic option
+# after a simulated latency, failing at the configured error rate. Known
+# questions never reach it; the question bank is consulted first. Token usage
+# is estimated from the prompt Gemini would have been sent.
+#
+# `skill` is the share of questions it "knows": those get local_truth(), the
+# answer the benchmark reveals as correct, with high confidence; the rest get
+# an arbitrary option with lower confidence. Tiers of different skill and
+# latency simulate a model cascade.
+def local_truth(question, options):
+    return min(
+        range(len(options)),
+        key=lambda i: hashlib.sha1(f"{question}\x1f{options[i]}".encode("utf-8")).digest(),
+    )
+
+
+class LocalEngine(AnswerEngine):
+    name = "local"
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, seed=0, skill=0.0, model="local"):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.skill = skill
+        self.model = model
+        self._rng = random.Random(seed)
+
+    async def answer_scored(self, question, options):
+        await asyncio.sleep(max(0.0, self._rng.gauss(self.latency, self.jitter)))
+        if self._rng.random() < self.error_rate:
+            raise AnswerError("simulated backend error")
+        token_usage.record(self.model, {"prompt": estimate_tokens(single_prompt(question, options)), "output": 1})
+        return self._pick(question, options)
+
+    def _pick(self, question, options):
+        if self._rng.random() < self.skill:
+            return local_truth(question, options), self._rng.uniform(0.85, 1.0)
+        digest = hashlib.sha1(normalize_text(question).encode("utf-8")).digest()
+        return digest[0] % len(options), self._rng.uniform(0.2, 0.9)
+
+    async def answer_batch(self, items):
+        # one simulated round trip for the whole batch, like a multi-question prompt
+        await asyncio.sleep(max(0.0, self._rng.gauss(self.latency, self.jitter)))
+        if self._rng.random() < self.error_rate:
+            raise AnswerError("simulated backend error")
+        token_usage.record(self.model, {"prompt": estimate_tokens(batch_prompt(items)), "output": 2 * len(items) + 1})
+        return [self._pick(q, o)[0] for q, o in items]
+
+
+# --------------------- Model Cascade ---------------------
+# Tiers ordered fastest/cheapest first. A poll goes to the first tier and is
+# escalated to the next only when that tier's confidence is below
+# min_confidence (or it gave no valid option) and the poll's deadline still
+# leaves room for the next tier's recent p90 latency. An answer without any
+# confidence signal is accepted as is. The tier that produced the final answer
+# is noted on the poll trace, so revealed results give per-tier accuracy.
+class CascadeEngine(AnswerEngine):
+    def __init__(self, tiers, min_confidence=0.8, vote_margin=0.5):
+        self.tiers = tiers
+        self.name = tiers[0].name
+        self.min_confidence = min_confidence
+        self.vote_margin = vote_margin
+        self.latency = [LatencyEstimate() for _ in tiers]
+        self.calls = [0] * len(tiers)
+        self.answers = [0] * len(tiers)
+        self.escalations = 0
+        self.no_time = 0
+        register_stats("cascade", self.stats)
+        register_collector(self._gauges)
+
+    async def answer_scored(self, question, options):
+        trace = current_trace()
+        deadline = getattr(trace, "deadline", None)
+        last = len(self.tiers) - 1
+        for n, tier in enumerate(self.tiers):
+            start = time.monotonic()
+            try:
+                idx, confidence = await tier.answer_scored(question, options)
+            except AnswerError:
+                if n == last:
+                    raise
+                idx, confidence = None, None
+            elapsed = time.monotonic() - start
+            self.calls[n] += 1
+            self.latency[n].observe(elapsed)
+            observe("cascade_tier_seconds", elapsed, model=tier.model)
+
+            sure = idx is not None and (confidence is None or confidence >= self.min_confidence)
+            if n < last and not sure:
+                reason = "no_answer" if idx is None else "low_confidence"
+                if deadline is None or time.monotonic() + self.latency[n + 1].value() + self.vote_margin < deadline:
+                    self.escalations += 1
+                    inc("cascade_escalations_total", reason=reason, model=tier.model)
+                    continue
+                self.no_time += 1
+                inc("cascade_escalations_skipped_total", reason=reason, model=tier.model)
+            self.answers[n] += 1
+            inc("cascade_answers_total", model=tier.model)
+            if trace is not None:
+                trace.model = tier.model
+            return idx, confidence
+
+    def stats(self):
+        polls = self.calls[0]
+        return {
+            "polls": polls,
+            "escalations": self.escalations,
+            "escalation_rate": round(self.escalations / polls, 3) if polls else 0,
+            "no_time_to_escalate": self.no_time,
+        }
+
+    def tier_stats(self):
+        return [
+            {
+                "model": tier.model,
+                "calls": self.calls[n],
+                "answers": self.answers[n],
+                "p90_s": round(self.latency[n].value(), 3),
+            }
+            for n, tier in enumerate(self.tiers)
+        ]
+
+    def _gauges(self):
+        for row in self.tier_stats():
+            yield "cascade_tier_calls", {"model": row["model"]}, row["calls"]
+            yield "cascade_tier_p90_seconds", {"model": row["model"]}, row["p90_s"]
+
+    async def close(self):
+        unregister_stats("cascade", self.stats)
+        unregister_collector(self._gauges)
+        for tier in self.tiers:
+            await tier.close()
+
+
+# --------------------- Micro-Batching ---------------------
+# Polls that arrive within ANSWER_BATCH_WINDOW of each other are answered by
+# one multi-question request; a window that closes with a single poll falls
+# back to the normal single request. Unanswered batch slots are retried alone.
+BATCH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 32)
+
+
+class BatchingEngine(AnswerEngine):
+    def __init__(self, inner, window=0.05, max_size=8):
+        self.inner = inner
+        self.name = inner.name
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._timer = None
+        self._tasks = set()  # the event loop only keeps weak references to tasks
+        self.batches = 0
+        self.batched_polls = 0
+        self.singles = 0
+        register_stats("answer_batch", self.stats)
+
+    async def answer(self, question, options):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((question, options, future, current_group()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: self._finished(t, batch))
+
+    def _finished(self, task, batch):
+        self._tasks.discard(task)
+        error = None if task.cancelled() else task.exception()
+        if error is not None:
+            logging.error(f"❌ Answer batch of {len(batch)} failed: {error!r}")
+        # nobody may be left waiting on a batch that died
+        for _, _, future, _ in batch:
+            if future.done():
+                continue
+            if error is None:
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    async def _run(self, batch):
+        observe("answer_batch_size", len(batch), buckets=BATCH_SIZE_BUCKETS)
+        if len(batch) == 1:
+            self.singles += 1
+            question, options, future, group = batch[0]
+            token_groups.set([group])
+            try:
+                result = await self.inner.answer(question, options)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            if not future.done():
+                future.set_result(result)
+            return
+
+        self.batches += 1
+        self.batched_polls += len(batch)
+        token_groups.set([g for _, _, _, g in batch])
+        try:
+            results = await self.inner.answer_batch([(q, o) for q, o, _, _ in batch])
+        except Exception as e:
+            logging.warning(f"⚠️ Batch of {len(batch)} failed ({e}), answering individually")
+            results = [None] * len(batch)
+
+        async def settle(question, options, future, group, result):
+            token_groups.set([group])
+            try:
+                if result is None:
+                    result = await self.inner.answer(question, options)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            if not future.done():
+                future.set_result(result)
+
+        await asyncio.gather(*(
+            settle(q, o, f, g, r) for (q, o, f, g), r in zip(batch, results)
+        ))
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "batched_polls": self.batched_polls,
+            "singles": self.singles,
+            "mean_batch_size": round(self.batched_polls / self.batches, 2) if self.batches else 0,
+        }
+
+    async def close(self):
+        unregister_stats("answer_batch", self.stats)
+        await self.inner.close()
+
+
+def create_engine(name=None):
+    name = name or config.ANSWER_ENGINE
+    if name == "gemini":
+        models = config.GEMINI_MODEL_TIERS
+        if len(models) > 1:
+            engine = CascadeEngine(
+                [GeminiEngine(model, logprobs=n < len(models) - 1) for n, model in enumerate(models)],
+                config.CASCADE_MIN_CONFIDENCE,
+                config.DEADLINE_VOTE_MARGIN,
+            )
+        else:
+            engine = GeminiEngine(models[0] if models else None)
+    elif name == "local":
+        tiers = [
+            LocalEngine(
+                latency=latency,
+                jitter=config.LOCAL_ENGINE_JITTER,
+                error_rate=config.LOCAL_ENGINE_ERROR_RATE,
+                seed=config.LOCAL_ENGINE_SEED + n,
+                skill=skill,
+                model=model,
+            )
+            for n, (model, latency, skill) in enumerate(config.LOCAL_ENGINE_TIERS)
+        ]
+        if len(tiers) > 1:
+            engine = CascadeEngine(tiers, config.CASCADE_MIN_CONFIDENCE, config.DEADLINE_VOTE_MARGIN)
+        elif tiers:
+            engine = tiers[0]
+        else:
+            engine = LocalEngine(
+                latency=config.LOCAL_ENGINE_LATENCY,
+                jitter=config.LOCAL_ENGINE_JITTER,
+                error_rate=config.LOCAL_ENGINE_ERROR_RATE,
+                seed=config.LOCAL_ENGINE_SEED,
+            )
+    else:
+        raise ValueError(f"Unknown ANSWER_ENGINE: {name}")
+    if config.ANSWER_BATCH_WINDOW > 0:
+        if isinstance(engine, CascadeEngine):
+            # a batch has no per-poll confidence or deadline to escalate on
+            logging.warning("⚠️ ANSWER_BATCH_WINDOW is ignored while a model cascade is configured")
+        else:
+            engine = BatchingEngine(engine, config.ANSWER_BATCH_WINDOW, config.ANSWER_BATCH_MAX)
+    return engine
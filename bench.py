@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from telethon import utils
+from telethon.tl.types import (
+    InputPeerChannel, Message, MessageMediaPoll, PeerChannel, Poll, PollAnswer, PollAnswerVoters, PollResults,
+    UpdateMessagePoll, UpdateNewChannelMessage,
+)
+
+import config
+import metrics
+import prompts
+from answer_engine import BatchingEngine, CascadeEngine, local_truth
+
+# Replays synthetic poll events into the real responder handler, with a stub
+# Telegram client and the local answer engine, and reports per-stage latency.
+#
+#   python bench.py --script single --rate 20 --count 500 --output run.json
+
+SCRIPTS = {
+    "single": "number_login_only",
+    "multi": "qr_code_and_number_loin_and_multiple_accoutns",
+}
+STAGES = ["queue", "extract", "cache", "bank", "admit", "model", "parse", "render", "delay", "vote"]
+
+
+# --------------------- Stub Telegram ---------------------
+class StubTelegramClient:
+    def __init__(self, vote_latency=0.03):
+        self.vote_latency = vote_latency
+        self.handlers = []
+        self.votes = 0
+        self._stop = None
+
+    def on(self, event_builder):
+        def decorator(fn):
+            self.handlers.append((event_builder, fn))
+            return fn
+        return decorator
+
+    def dispatch(self, update):
+        # what Telethon does per update: every builder whose filter accepts it
+        return [
+            asyncio.create_task(handler(update))
+            for builder, handler in self.handlers
+            if builder.filter(update)
+        ]
+
+    def add_event_handler(self, fn, event_builder=None):
+        self.handlers.append((event_builder, fn))
+
+    def remove_event_handler(self, fn, event_builder=None):
+        self.handlers = [(b, f) for b, f in self.handlers if f is not fn]
+
+    async def get_input_entity(self, peer):
+        peer_id, peer_type = utils.resolve_id(peer if isinstance(peer, int) else utils.get_peer_id(peer))
+        return InputPeerChannel(peer_id, 0)
+
+    async def __call__(self, request):
+        await asyncio.sleep(self.vote_latency)
+        self.votes += 1
+
+    async def run_until_disconnected(self):
+        self._stop = asyncio.Event()
+        await self._stop.wait()
+
+    def disconnect(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    async def wait_ready(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not self.handlers:
+            if time.monotonic() > deadline:
+                raise RuntimeError("responder_loop never registered a handler")
+            await asyncio.sleep(0.01)
+
+
+def make_poll_message(msg_id, channel_id, question, options, close_period=None, date=None):
+    poll = Poll(
+        id=random.getrandbits(62),
+        question=question,
+        answers=[PollAnswer(text=opt, option=bytes([i])) for i, opt in enumerate(options)],
+        quiz=True,
+        close_period=close_period,
+    )
+    return Message(
+        id=msg_id,
+        peer_id=PeerChannel(channel_id),
+        date=date or datetime.now(timezone.utc),
+        message="",
+        media=MessageMediaPoll(poll=poll, results=PollResults()),
+    )
+
+
+def make_reveal_update(message):
+    # the "true" answer is a fixed function of the question and option text
+    # (stable across reposts with shuffled options); the plain local engine
+    # does not know it, so its accuracy sits near 1/len(options), while
+    # simulated cascade tiers know it for their `skill` share of questions
+    poll = message.media.poll
+    correct = local_truth(poll.question, [a.text for a in poll.answers])
+    voters = [
+        PollAnswerVoters(option=a.option, voters=1, chosen=False, correct=i == correct)
+        for i, a in enumerate(poll.answers)
+    ]
+    return UpdateMessagePoll(poll_id=poll.id, poll=poll, results=PollResults(results=voters))
+
+
+def make_text_message(msg_id, channel_id, text):
+    return Message(id=msg_id, peer_id=PeerChannel(channel_id), date=datetime.now(timezone.utc), message=text)
+
+
+# --------------------- Synthetic Stream ---------------------
+def synthetic_polls(count, channel_ids, repeat_ratio=0.2, option_count=4, seed=0, max_seen=None):
+    # reposts are drawn from the last `max_seen` questions (all of them by default)
+    rng = random.Random(seed)
+    seen = deque(maxlen=max_seen)
+    for msg_id in range(1, count + 1):
+        if seen and rng.random() < repeat_ratio:
+            question, options = rng.choice(seen)
+            options = rng.sample(options, len(options))
+        else:
+            n = len(seen) + 1
+            question = f"Synthetic question #{n}: which option is correct for item {rng.randint(1, 10**6)}?"
+            options = [f"Answer {chr(65 + i)} for #{n}" for i in range(option_count)]
+            seen.append((question, options))
+        yield msg_id, rng.choice(channel_ids), question, options
+
+
+def summarize(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(pick(50) * 1000, 3),
+        "p95_ms": round(pick(95) * 1000, 3),
+        "p99_ms": round(pick(99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+# --------------------- Pipeline Loading ---------------------
+def load_pipeline(script, session_folder, overrides=None):
+    # config values are read at import by the scripts, so override first
+    config.SESSION_FOLDER = session_folder
+    config.ANSWER_ENGINE = "local"
+    for name, value in (overrides or {}).items():
+        setattr(config, name, value)
+    return importlib.import_module(SCRIPTS[script])
+
+
+def silence_ui(module):
+    import rich
+    devnull = open(os.devnull, "w")
+    module.console.file = devnull
+    rich.reconfigure(file=devnull)
+    if hasattr(module, "start_console"):
+        # pre-create the shared console worker so its output goes nowhere too
+        module.start_console(config.HEADLESS, config.UI_FLUSH_INTERVAL).stream = devnull
+
+
+def build_overrides(args):
+    return {
+        "LOCAL_ENGINE_LATENCY": args.engine_latency,
+        "LOCAL_ENGINE_JITTER": args.engine_jitter,
+        "LOCAL_ENGINE_ERROR_RATE": args.engine_error_rate,
+        "LOCAL_ENGINE_SEED": args.seed,
+        "ANSWER_SPEED": args.answer_speed,
+        "HEADLESS": args.headless,
+        "ANSWER_BATCH_WINDOW": args.batch_window,
+        "QUESTION_BANK_PATH": args.bank,
+        "GEMINI_CONCURRENCY": args.concurrency,
+        "QUEUE_WORKERS": args.workers,
+        "QUEUE_MAX_SIZE": args.queue_size,
+        "LOCAL_ENGINE_TIERS": [parse_tier(t) for t in args.tier or []],
+        "CASCADE_MIN_CONFIDENCE": args.min_confidence,
+        "RECORD_POLLS_PATH": args.record,
+    }
+
+
+def parse_tier(spec):
+    # "name:latency:skill", e.g. "lite:0.03:0.6"
+    name, latency, skill = spec.split(":")
+    return name, float(latency), float(skill)
+
+
+async def reveal(client, message, delay):
+    await asyncio.sleep(delay)
+    await asyncio.gather(*client.dispatch(make_reveal_update(message)))
+
+
+async def drive(module, client, groups, polls, rate, arrival="fixed", seed=0, reveal_after=None, close_periods=None,
+                chatter=0):
+    rng = random.Random(seed)
+    chatter_ids = itertools.count(10**6)
+    traces = []
+    metrics.trace_sinks.append(traces.append)
+    responder = asyncio.create_task(module.responder_loop(client, groups))
+    await client.wait_ready()
+
+    tasks = []
+    start = time.monotonic()
+    next_at = start
+    for msg_id, channel_id, question, options in polls:
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        for n in range(chatter):
+            # ordinary messages from other chats, which the handler must shrug off
+            text = make_text_message(next(chatter_ids), 2_000_000 + n % 50, "just chatting")
+            tasks.extend(client.dispatch(UpdateNewChannelMessage(text, pts=0, pts_count=1)))
+        close_period = rng.choice(close_periods) if close_periods else None
+        message = make_poll_message(msg_id, channel_id, question, options, close_period)
+        tasks.extend(client.dispatch(UpdateNewChannelMessage(message, pts=msg_id, pts_count=1)))
+        if reveal_after is not None:
+            tasks.append(asyncio.create_task(reveal(client, message, reveal_after)))
+        gap = 1.0 / rate
+        next_at += rng.expovariate(rate) if arrival == "poisson" else gap
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    await module.poll_queue.join()  # handlers only enqueue; wait for the workers
+    elapsed = time.monotonic() - start
+    client.disconnect()
+    await responder
+    if module.poll_recorder is not None:
+        module.poll_recorder.close()
+    metrics.trace_sinks.remove(traces.append)
+    errors = [r for r in results if isinstance(r, Exception)]
+    return traces, elapsed, errors
+
+
+def report(args, module, client, traces, elapsed, errors):
+    stages = {}
+    for name in STAGES:
+        summary = summarize([t.stages[name] for t in traces if name in t.stages])
+        if summary:
+            stages[name] = summary
+    return {
+        "script": args.script,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "params": {
+            "count": args.count,
+            "rate": args.rate,
+            "arrival": args.arrival,
+            "groups": args.groups,
+            "repeat_ratio": args.repeat_ratio,
+            "engine_latency": args.engine_latency,
+            "engine_jitter": args.engine_jitter,
+            "engine_error_rate": args.engine_error_rate,
+            "vote_latency": args.vote_latency,
+            "answer_speed": args.answer_speed,
+            "ui": args.ui,
+            "headless": args.headless,
+            "batch_window": args.batch_window,
+            "bank": args.bank,
+            "reveal_after": args.reveal_after,
+            "close_period": args.close_period,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "queue_size": args.queue_size,
+            "chatter": args.chatter,
+            "tiers": args.tier,
+        },
+        "polls": len(traces),
+        "errors": len(errors),
+        "votes": client.votes,
+        "unvoted": len(traces) - client.votes,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_pps": round(len(traces) / elapsed, 2) if elapsed else None,
+        "latency": {"total": summarize([t.total for t in traces]), "stages": stages},
+        "cache": module.answer_cache.stats(),
+        "batching": module.answer_engine.stats() if isinstance(module.answer_engine, BatchingEngine) else None,
+        "question_bank": module.question_bank.stats() if module.question_bank is not None else None,
+        "deadline_misses": {
+            name: value for name, value in metrics.snapshot()["counters"].items()
+            if name.startswith("deadline_misses_total")
+        },
+        "model_gate": module.model_gate.stats(),
+        "poll_queue": module.poll_queue.stats(),
+        "quiz_results": {
+            "accuracy_pct": module.quiz_results.accuracy(),
+            "model_accuracy_pct": module.quiz_results.accuracy(source="model"),
+            "learned": module.quiz_results.learned,
+        },
+        "cascade": dict(
+            module.answer_engine.stats(),
+            tiers=module.answer_engine.tier_stats(),
+            accuracy_pct=module.quiz_results.model_accuracy(),
+        ) if isinstance(module.answer_engine, CascadeEngine) else None,
+        "tokens": dict(prompts.token_usage.stats(), **prompts.token_usage.report()),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Poll-to-vote latency benchmark with stubbed Telegram and answer engine")
+    parser.add_argument("--script", choices=SCRIPTS, default="single")
+    parser.add_argument("--count", type=int, default=200, help="number of polls to replay")
+    parser.add_argument("--rate", type=float, default=10.0, help="polls per second")
+    parser.add_argument("--arrival", choices=["fixed", "poisson"], default="fixed")
+    parser.add_argument("--groups", type=int, default=3)
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="fraction of reposted questions")
+    parser.add_argument("--engine-latency", type=float, default=0.05)
+    parser.add_argument("--engine-jitter", type=float, default=0.02)
+    parser.add_argument("--engine-error-rate", type=float, default=0.0)
+    parser.add_argument("--vote-latency", type=float, default=0.03)
+    parser.add_argument("--answer-speed", choices=list(config.SPEED_DELAY), default=config.ANSWER_SPEED)
+    parser.add_argument("--ui", choices=["null", "terminal"], default="null",
+                        help="render Rich output to /dev/null (still rendered) or to the terminal")
+    parser.add_argument("--headless", action="store_true", help="plain batched log lines instead of Rich panels")
+    parser.add_argument("--batch-window", type=float, default=0.0, help="micro-batching window in seconds (0 = off)")
+    parser.add_argument("--bank", help="question bank (CSV/JSONL or .qbi) consulted before the engine")
+    parser.add_argument("--reveal-after", type=float, help="reveal each quiz's correct option after this many seconds")
+    parser.add_argument("--close-period", type=int, nargs="+",
+                        help="give each poll a close_period (s) picked from these values")
+    parser.add_argument("--concurrency", type=int, default=config.GEMINI_CONCURRENCY, help="concurrent model answers")
+    parser.add_argument("--workers", type=int, default=config.QUEUE_WORKERS, help="poll queue workers")
+    parser.add_argument("--queue-size", type=int, default=config.QUEUE_MAX_SIZE, help="max queued polls")
+    parser.add_argument("--chatter", type=int, default=0, help="non-poll messages from other chats per poll")
+    parser.add_argument("--tier", action="append", metavar="NAME:LATENCY:SKILL",
+                        help="simulated cascade tier, fastest first (repeat for each tier)")
+    parser.add_argument("--min-confidence", type=float, default=config.CASCADE_MIN_CONFIDENCE,
+                        help="cascade escalation threshold")
+    parser.add_argument("--record", metavar="PATH", help="also record the polls to this log (see replay.py)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+async def run_benchmark(args):
+    session_folder = tempfile.mkdtemp(prefix="bench-")
+    module = load_pipeline(args.script, session_folder, build_overrides(args))
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    if args.ui == "null":
+        silence_ui(module)
+
+    channel_ids = [1_000_000 + i for i in range(args.groups)]
+    groups = {f"bench{i}": utils.get_peer_id(PeerChannel(cid)) for i, cid in enumerate(channel_ids)}
+    client = StubTelegramClient(args.vote_latency)
+    polls = synthetic_polls(args.count, channel_ids, args.repeat_ratio, seed=args.seed)
+    traces, elapsed, errors = await drive(
+        module, client, groups, polls, args.rate, args.arrival, args.seed, args.reveal_after, args.close_period,
+        args.chatter,
+    )
+    return report(args, module, client, traces, elapsed, errors)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run_benchmark(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ API_HASH = "<YOUR_API_HASH>"
 BOT_TOKEN = "<YOUR_BOT_TOKEN>"
 
 # ----------------- Multi-Group Support -----------------
+# Group titles (or part of them) from your dialogs, or "@username"
 TARGET_GROUPS = [
     "group_name_here"
 ]
@@ -22,12 +23,16 @@ SPEED_DELAY = {
     "normal": 0.5
 }
 
-# Enable FAST_MODE (reduces wait times, uses short prompts)
+# Enable FAST_MODE (halves the answer delay, capped at 0.2s)
 FAST_MODE = True
 
 # Auto-tick correct poll option (do NOT send message, just vote)
 AUTO_TICK = True
 
+# Retry a vote once after a flood wait of at most this many seconds; longer
+# waits drop the vote (the poll is usually over by then)
+VOTE_FLOOD_MAX_WAIT = 3
+
 # ----------------- Gemini API -----------------
 # Supports multiple keys; fallback automatically if one fails
 GEMINI_API_KEYS = [
@@ -35,10 +40,107 @@ GEMINI_API_KEYS = [
     "<YOUR_GEMINI_API_KEY_2>"
 ]
 GEMINI_MODEL = "gemini-2.5-flash"
+# Model cascade, fastest first, e.g. ["gemini-2.5-flash-lite", "gemini-2.5-flash"]:
+# a poll is escalated to the next model only when the previous one's confidence
+# (from token log-probabilities) is below CASCADE_MIN_CONFIDENCE and the poll's
+# deadline leaves time for it. Empty = GEMINI_MODEL only.
+GEMINI_MODEL_TIERS = []
+CASCADE_MIN_CONFIDENCE = 0.8
+
+# Native async transport (pooled aiohttp session); set False to fall back to
+# the blocking google-genai SDK running in a worker thread
+GEMINI_ASYNC_TRANSPORT = True
+# Max Gemini requests in flight at once (across all groups/accounts)
+GEMINI_CONCURRENCY = 8
+# Per-request timeout (seconds)
+GEMINI_TIMEOUT = 15
+# Seconds a key sits out after a 429 (unless the API sends its own retry delay)
+GEMINI_RATE_LIMIT_COOLDOWN = 30
+# Base cooldown after other key errors, doubled on each consecutive failure
+# (timeouts and 5xx fail over to another key without a cooldown)
+GEMINI_ERROR_COOLDOWN = 2
+
+# Replies are constrained to a single option number; these bound decode time
+GEMINI_MAX_OUTPUT_TOKENS = 4
+# Thinking tokens for 2.5 models (0 = off, None = model default), or a dict per
+# model, e.g. {"gemini-2.5-flash": 0, "gemini-2.5-pro": 128}. 2.5 Pro cannot turn
+# thinking off, so 0 is not sent to it. GEMINI_MAX_OUTPUT_TOKENS only applies
+# when thinking is off (thinking tokens count toward the limit); the SDK
+# fallback cannot turn thinking off.
+GEMINI_THINKING_BUDGET = 0
+# Re-ask this many times when a reply is not a valid option number
+GEMINI_PARSE_RETRIES = 1
+# Options longer than this many characters are cut short in the prompt (0 = never)
+PROMPT_MAX_OPTION_CHARS = 0
+
+# Hedged requests: if a reply is slower than the recent p<PERCENTILE> latency,
+# send a duplicate on another key and keep whichever answers first
+GEMINI_HEDGE = False
+GEMINI_HEDGE_PERCENTILE = 90
+# Hedge delay used until enough latency samples exist, and its lower bound
+GEMINI_HEDGE_INITIAL_DELAY = 1.5
+GEMINI_HEDGE_MIN_DELAY = 0.3
+# Max fraction of requests that may be hedged (extra quota spent)
+GEMINI_HEDGE_MAX_RATE = 0.1
+
+# ----------------- Answer Engine -----------------
+# "gemini" for live answers, "local" for an offline stand-in (benchmarks/load tests)
+ANSWER_ENGINE = "gemini"
+# Local engine: simulated latency (mean/stddev seconds), failure rate, RNG seed
+LOCAL_ENGINE_LATENCY = 0.05
+LOCAL_ENGINE_JITTER = 0.02
+LOCAL_ENGINE_ERROR_RATE = 0.0
+LOCAL_ENGINE_SEED = 0
+# Simulated cascade for the local engine: [(name, latency seconds, skill 0..1)]
+LOCAL_ENGINE_TIERS = []
+# Optional CSV/JSONL question bank (question, options, answer) checked before the
+# model; indexed once into <path>.qbi (or build it with: python question_bank.py build)
+QUESTION_BANK_PATH = None
+# Minimum estimated similarity for a reworded question to reuse a bank answer
+QUESTION_BANK_THRESHOLD = 0.85
+# Micro-batching: polls arriving within this window (seconds) share one
+# multi-question request. 0 disables batching; ANSWER_BATCH_MAX caps a batch.
+ANSWER_BATCH_WINDOW = 0
+ANSWER_BATCH_MAX = 8
 
 # ----------------- Session Management -----------------
 SESSION_FOLDER = "sessions"
 
+# ----------------- Poll Queue -----------------
+# Polls are queued by the event handler and answered by a fixed worker pool
+QUEUE_WORKERS = 16
+# Max polls waiting; when full, the group with the most waiting polls loses
+# its "oldest" or "newest" one
+QUEUE_MAX_SIZE = 200
+QUEUE_DROP_POLICY = "oldest"
+
+# ----------------- Poll Deadlines -----------------
+# Polls with close_period/close_date are only sent to the model if the answer
+# (recent p90 model time) plus this vote margin (seconds) fits before closing;
+# while GEMINI_CONCURRENCY answers are in flight, the earliest deadline goes next
+DEADLINE_VOTE_MARGIN = 0.5
+
+# ----------------- Group Resolution -----------------
+# Resolved TARGET_GROUPS peer ids, stored in SESSION_FOLDER
+GROUP_CACHE_FILE = "groups.json"
+# Rescan dialogs in the background this often (seconds); 0 disables
+GROUP_REFRESH_INTERVAL = 1800
+
+# ----------------- Answer Cache -----------------
+# Answers are cached by question text + option set in SESSION_FOLDER
+ANSWER_CACHE_DB = "answer_cache.sqlite3"
+# Max answers kept in memory (older ones stay on disk)
+ANSWER_CACHE_SIZE = 5000
+# Drop cached answers older than this (seconds)
+ANSWER_CACHE_TTL = 30 * 24 * 3600
+
+# ----------------- Quiz Results -----------------
+# Correct options revealed by closed/voted quizzes fix the answer cache and
+# measure accuracy per group (stored in SESSION_FOLDER)
+QUIZ_STATS_FILE = "quiz_accuracy.json"
+# Results needed before a measured accuracy is shown
+QUIZ_ACCURACY_MIN_SAMPLES = 5
+
 # ----------------- Other Settings -----------------
 # Max number of QR login attempts per account
 MAX_QR_ATTEMPTS = 3
@@ -50,5 +152,34 @@ MAX_2FA_ATTEMPTS = 3
 # Telegram internal delays for async tasks (optional fine-tuning)
 ASYNC_DELAY = 0.05
 
+# ----------------- Live Reload -----------------
+# Seconds between checks of this file for changes (0 disables). ANSWER_SPEED,
+# SPEED_DELAY, FAST_MODE, AUTO_TICK, TARGET_GROUPS, GEMINI_API_KEYS, GEMINI_MODEL,
+# GEMINI_MODEL_TIERS and CASCADE_MIN_CONFIDENCE apply without a restart; an
+# invalid edit is rejected and logged, and the running settings stay.
+CONFIG_RELOAD_INTERVAL = 2
+
+# ----------------- Console -----------------
+# Headless/daemon mode: plain batched log lines instead of Rich panels
+HEADLESS = False
+# Console output is written by a background thread at most this often (seconds)
+UI_FLUSH_INTERVAL = 0.25
+
+# ----------------- Metrics -----------------
+# Prometheus-style endpoint at http://METRICS_HOST:METRICS_PORT/metrics (0 disables)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+# Optional file that receives one JSON line of stage timings per poll
+METRICS_JSONL_PATH = None
+# Optional append-only log of every poll (question, options, timing, answer)
+# for offline replay with replay.py; ".gz" or ".zst" (needs zstandard) compress
+RECORD_POLLS_PATH = None
+# Seconds between samples of RSS, live asyncio tasks and threads, exported as
+# process_* gauges with their growth per hour (0 disables)
+RESOURCE_SAMPLE_INTERVAL = 60
+# Python frames kept per allocation by tracemalloc, for process_traced_bytes
+# (0 = off; tracing slows every allocation, so enable it only to hunt a leak)
+RESOURCE_TRACEMALLOC_FRAMES = 0
+
 # ----------------- Logging -----------------
 LOG_LEVEL = "INFO"
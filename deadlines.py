@@ -0,0 +1,95 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+
+
+def poll_deadline(message):
+    # monotonic time at which the poll closes, or None for open-ended polls
+    poll = message.media.poll
+    if poll.close_date is not None:
+        closes_at = poll.close_date.timestamp()
+    elif poll.close_period and message.date is not None:
+        closes_at = message.date.timestamp() + poll.close_period
+    else:
+        return None
+    return time.monotonic() + (closes_at - time.time())
+
+
+# --------------------- Latency Estimate ---------------------
+# Recent model answer times; a poll is only sent to the model when its
+# remaining time covers the recent p90.
+class LatencyEstimate:
+    def __init__(self, percentile=90, window=100, min_samples=5):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def value(self):
+        if len(self._samples) < self.min_samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+
+# --------------------- Deadline Gate ---------------------
+# Admission to the model, limited to `limit` concurrent answers. While all
+# slots are busy, waiting polls are admitted earliest-deadline-first (polls
+# without a deadline go last, in arrival order); a poll whose wait would run
+# past its deadline gives up instead of taking a slot it cannot use.
+class DeadlineGate:
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []  # heap of (deadline, seq, future)
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.queued = 0
+        self.expired = 0
+
+    async def acquire(self, deadline=None, timeout=None):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (math.inf if deadline is None else deadline, next(self._seq), future))
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # a slot was handed over just as we were cancelled
+            else:
+                future.cancel()
+            raise
+        if future.done() and not future.cancelled():
+            self.admitted += 1
+            return True
+        future.cancel()  # left in the heap, skipped on release
+        self.expired += 1
+        return False
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)  # the slot passes straight to the waiter
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": sum(1 for _, _, f in self._waiters if not f.done()),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "expired": self.expired,
+        }
@@ -0,0 +1,140 @@
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+
+
+# --------------------- Console Worker ---------------------
+# The poll path never touches the terminal: log records and dashboard panels
+# are queued here and written by one background thread in batches. In
+# headless mode every item becomes a plain text line; otherwise each item's
+# Rich renderer runs on the worker thread. Rendering panels is slow, so when
+# the backlog passes a quarter of `max_pending` new items are written as plain
+# lines instead, and past `max_pending` they are dropped (and counted), so a
+# burst of polls cannot grow the queue without bound.
+class ConsoleWorker:
+    def __init__(self, headless=False, flush_interval=0.25, stream=None, max_batch=200, max_pending=2000):
+        self.headless = headless
+        self.flush_interval = flush_interval
+        self.stream = stream or sys.stderr
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.formatter = logging.Formatter('[%(asctime)s] %(levelname)s - %(message)s')
+        self.dropped = 0
+        self.plain = 0  # panels written as plain lines because the worker was behind
+        self._queue = queue.SimpleQueue()
+        self._stop = object()
+        self._thread = threading.Thread(target=self._run, name="console-worker", daemon=True)
+        self._thread.start()
+
+    def show(self, text, render=None):
+        backlog = self._queue.qsize()
+        if backlog >= self.max_pending:
+            self.dropped += 1
+            return
+        if render is not None and backlog >= self.max_pending // 4:
+            render = None
+            self.plain += 1
+        self._queue.put((text, render))
+
+    def log(self, record):
+        if self._queue.qsize() >= self.max_pending:
+            self.dropped += 1
+            return
+        self._queue.put((record, None))
+
+    def _text(self, item):
+        return self.formatter.format(item) if isinstance(item, logging.LogRecord) else item
+
+    def _write(self, batch):
+        if self.headless:
+            self.stream.write("\n".join(self._text(text) for text, _ in batch) + "\n")
+            self.stream.flush()
+            return
+        for text, render in batch:
+            if render is not None:
+                render()
+            else:
+                self.stream.write(self._text(text) + "\n")
+        self.stream.flush()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._stop:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is self._stop:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            except Exception:
+                self.dropped += len(batch)
+            if stopping:
+                return
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "plain": self.plain, "dropped": self.dropped}
+
+    def close(self, timeout=2.0):
+        self._queue.put(self._stop)
+        self._thread.join(timeout)
+
+
+class QueuedLogHandler(logging.Handler):
+    def __init__(self, worker):
+        super().__init__()
+        self.worker = worker
+
+    def emit(self, record):
+        # render the message now so args captured by reference can't change
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.worker.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        self.worker.log(record)
+
+
+_worker = None
+
+def start_console(headless=False, flush_interval=0.25):
+    # one worker per process; later calls (e.g. one per account) share it
+    global _worker
+    if _worker is None:
+        _worker = ConsoleWorker(headless=headless, flush_interval=flush_interval)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(QueuedLogHandler(_worker))
+        atexit.register(_stop_console)
+    return _worker
+
+
+def _stop_console():
+    # the worker is a daemon thread: drain what is queued (shutdown messages,
+    # "Stopped by user") before the interpreter exits, then log straight to the
+    # stream for anything later
+    global _worker
+    if _worker is None:
+        return
+    worker, _worker = _worker, None
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueuedLogHandler):
+            root.removeHandler(handler)
+    handler = logging.StreamHandler(worker.stream)
+    handler.setFormatter(worker.formatter)
+    root.addHandler(handler)
+    worker.close()
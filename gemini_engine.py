@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import math
+import ssl
+import time
+from collections import deque
+
+import aiohttp
+import certifi
+
+import config
+import metrics
+from key_pool import KeyPool, error_status, is_bad_key_error, is_request_error
+from prompts import token_usage
+
+ssl_context = ssl.create_default_context(cafile=certifi.where())
+
+GEMINI_ENDPOINT = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+GEMINI_MODEL_ENDPOINT = "https://generativelanguage.googleapis.com/v1beta/models/{model}"
+
+
+class GeminiError(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"{status} {message}")
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+# --------------------- Gemini API Manager ---------------------
+key_pool = KeyPool(
+    config.GEMINI_API_KEYS,
+    rate_limit_cooldown=config.GEMINI_RATE_LIMIT_COOLDOWN,
+    error_cooldown=config.GEMINI_ERROR_COOLDOWN,
+)
+
+# --------------------- Async Transport ---------------------
+# One pooled aiohttp session for every Gemini call; the semaphore caps how many
+# requests are on the wire at once across all groups and accounts. The
+# connection pool itself is unbounded: a hedge runs inside its primary's
+# semaphore slot and the key probe outside any, and neither should queue for
+# a connection.
+_session = None
+_semaphore = None
+
+def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            ssl=ssl_context,
+            limit=0,
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=config.GEMINI_TIMEOUT),
+        )
+    return _session
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(config.GEMINI_CONCURRENCY)
+    return _semaphore
+
+def _retry_after(resp, error):
+    header = resp.headers.get("Retry-After")
+    if header and header.isdigit():
+        return float(header)
+    for detail in error.get("details") or []:
+        delay = detail.get("retryDelay")
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return float(delay[:-1])
+            except ValueError:
+                pass
+    return None
+
+def _response_text(data):
+    parts = []
+    for candidate in data.get("candidates") or []:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            if "text" in part:
+                parts.append(part["text"])
+        if parts:
+            break
+    return "".join(parts)
+
+def _response_usage(data):
+    usage = data.get("usageMetadata") or {}
+    return {
+        "prompt": usage.get("promptTokenCount", 0),
+        "output": usage.get("candidatesTokenCount", 0),
+        "thoughts": usage.get("thoughtsTokenCount", 0),
+    }
+
+def _response_confidence(data):
+    # probability of the returned reply from its token log-probabilities
+    # (sent when responseLogprobs is on; avgLogprobs otherwise), else None
+    for candidate in data.get("candidates") or []:
+        chosen = (candidate.get("logprobsResult") or {}).get("chosenCandidates")
+        if chosen:
+            return math.exp(sum(c.get("logProbability", 0.0) for c in chosen))
+        if candidate.get("avgLogprobs") is not None:
+            return math.exp(candidate["avgLogprobs"])
+        return None
+    return None
+
+def build_request(text, generation_config=None):
+    body = {"contents": [{"role": "user", "parts": [{"text": text}]}]}
+    if generation_config:
+        body["generationConfig"] = generation_config
+    return body
+
+async def generate_content_async(api_key, model, body):
+    # -> (reply text, token usage, confidence or None)
+    session = _get_session()
+    async with session.post(
+        GEMINI_ENDPOINT.format(model=model),
+        headers={"x-goog-api-key": api_key},
+        json=body,
+    ) as resp:
+        data = await resp.json(content_type=None)
+        if resp.status != 200:
+            error = (data or {}).get("error", {}) if isinstance(data, dict) else {}
+            raise GeminiError(resp.status, error.get("message") or resp.reason, _retry_after(resp, error))
+        return _response_text(data), _response_usage(data), _response_confidence(data)
+
+# --------------------- Startup Key Probe ---------------------
+# Keys start out usable; this runs in the background while Telegram logs in
+# and checks every key concurrently with a model metadata lookup, which costs
+# no generation quota.
+async def _probe_key(key):
+    try:
+        async with _get_session().get(
+            GEMINI_MODEL_ENDPOINT.format(model=config.GEMINI_MODEL),
+            headers={"x-goog-api-key": key.api_key},
+        ) as resp:
+            if resp.status == 200:
+                key_pool.mark(key, healthy=True)
+                logging.info(f"✅ Gemini API key {key.label} OK")
+                return True
+            data = await resp.json(content_type=None)
+            error = (data or {}).get("error", {}) if isinstance(data, dict) else {}
+            raise GeminiError(resp.status, error.get("message") or resp.reason, _retry_after(resp, error))
+    except Exception as e:
+        if error_status(e) == 429:
+            # valid but busy; let the pool's cooldown handle it
+            cooldown = getattr(e, "retry_after", None) or config.GEMINI_RATE_LIMIT_COOLDOWN
+            key_pool.mark(key, healthy=True, reason=e, cooldown=cooldown)
+            logging.warning(f"⏳ Gemini API key {key.label} is rate-limited at startup")
+            return True
+        if is_bad_key_error(error_status(e), e):
+            key_pool.mark(key, healthy=False, reason=e)
+            logging.warning(f"❌ Gemini API key {key.label} failed | {e}")
+            return False
+        # network trouble says nothing about the key; leave it in rotation
+        logging.warning(f"⚠️ Could not verify Gemini API key {key.label} | {e}")
+        return True
+
+async def probe_gemini_keys():
+    start = time.monotonic()
+    results = await asyncio.gather(*(_probe_key(k) for k in key_pool.keys))
+    healthy = sum(results)
+    logging.info(f"🔑 Gemini key probe finished in {time.monotonic() - start:.2f}s: {healthy}/{len(results)} usable")
+    if not healthy:
+        logging.error("❌ All Gemini API keys failed! Only cached answers will be available.")
+    return healthy
+
+async def reload_gemini_keys(api_keys):
+    # GEMINI_API_KEYS changed at runtime: only the new keys are probed
+    added = key_pool.set_keys(api_keys)
+    logging.info(f"🔑 Gemini key pool now has {len(key_pool.keys)} key(s), {len(added)} new")
+    if added:
+        await asyncio.gather(*(_probe_key(k) for k in added))
+
+async def close_gemini_transport():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+# --------------------- Gemini Answer ---------------------
+# Sync SDK path, kept as a fallback when GEMINI_ASYNC_TRANSPORT is off
+# REST generationConfig fields the 0.5 SDK understands (no thinkingConfig there)
+_SDK_CONFIG_FIELDS = {
+    "responseMimeType": "response_mime_type",
+    "responseSchema": "response_schema",
+    "maxOutputTokens": "max_output_tokens",
+    "temperature": "temperature",
+    "candidateCount": "candidate_count",
+    "responseLogprobs": "response_logprobs",
+}
+
+def generate_content_sync(key, model, body):
+    generation_config = body.get("generationConfig") or {}
+    sdk_config = {
+        _SDK_CONFIG_FIELDS[k]: v for k, v in generation_config.items() if k in _SDK_CONFIG_FIELDS
+    }
+    response = key.sdk_client().models.generate_content(
+        model=model,
+        contents=body["contents"],
+        config=sdk_config or None,
+    )
+    usage = response.usage_metadata
+    confidence = None
+    if response.candidates:
+        candidate = response.candidates[0]
+        chosen = candidate.logprobs_result.chosen_candidates if candidate.logprobs_result else None
+        if chosen:
+            confidence = math.exp(sum(c.log_probability or 0.0 for c in chosen))
+        elif candidate.avg_logprobs is not None:
+            confidence = math.exp(candidate.avg_logprobs)
+    return response.text or "", {
+        "prompt": getattr(usage, "prompt_token_count", None) or 0,
+        "output": getattr(usage, "candidates_token_count", None) or 0,
+        "thoughts": getattr(usage, "thoughts_token_count", None) or 0,
+    }, confidence
+
+# --------------------- Hedged Requests ---------------------
+# When GEMINI_HEDGE is on and the first request is slower than the recent
+# GEMINI_HEDGE_PERCENTILE latency, a duplicate goes out on another key and the
+# first usable reply wins. GEMINI_HEDGE_MAX_RATE caps the extra traffic.
+_latencies = deque(maxlen=200)
+hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+def hedge_threshold():
+    if len(_latencies) < 20:
+        return config.GEMINI_HEDGE_INITIAL_DELAY
+    ordered = sorted(_latencies)
+    idx = min(len(ordered) - 1, int(len(ordered) * config.GEMINI_HEDGE_PERCENTILE / 100))
+    return max(config.GEMINI_HEDGE_MIN_DELAY, ordered[idx])
+
+def hedge_rate():
+    return hedge_stats["hedged"] / hedge_stats["requests"] if hedge_stats["requests"] else 0.0
+
+def get_hedge_stats():
+    return dict(hedge_stats, hedge_rate=round(hedge_rate(), 3), threshold=round(hedge_threshold(), 3))
+
+NO_ANSWER = ("No answer", None)
+
+async def _fetch_with_failover(body, tried, model):
+    # -> (reply text, confidence or None), NO_ANSWER when every key failed
+    for _ in range(len(key_pool.keys)):
+        key = key_pool.acquire(exclude=tried)
+        if key is None:
+            break
+        tried.add(key.index)
+        start = time.monotonic()
+        try:
+            if config.GEMINI_ASYNC_TRANSPORT:
+                answer, usage, confidence = await generate_content_async(key.api_key, model, body)
+            else:
+                answer, usage, confidence = await asyncio.to_thread(generate_content_sync, key, model, body)
+        except asyncio.CancelledError:
+            key_pool.release(key, cancelled=True)
+            raise
+        except Exception as e:
+            key_pool.release(key, error=e, retry_after=getattr(e, "retry_after", None))
+            status = error_status(e)
+            if is_request_error(status, e):
+                # another key would be refused the same way; the caller gets the error
+                metrics.inc("gemini_requests_total", outcome="rejected", status=status)
+                logging.error(f"❌ Gemini rejected the request ({model}): {e}")
+                if isinstance(e, GeminiError):
+                    raise
+                raise GeminiError(status, str(e)) from e
+            metrics.inc("gemini_requests_total", outcome="error", status=status or "none")
+            metrics.inc("gemini_key_switches_total")
+            logging.error(f"Gemini API error on key {key.label}: {e}. Trying next key...")
+            continue
+        key_pool.release(key)
+        token_usage.record(key.label, usage)
+        metrics.inc("gemini_requests_total", outcome="ok", status=200)
+        metrics.observe("gemini_request_seconds", time.monotonic() - start)
+        _latencies.append(time.monotonic() - start)
+        return answer.strip(), confidence
+    if not tried:
+        metrics.inc("gemini_no_key_available_total")
+        logging.warning("⏳ No Gemini key available (all cooling down or disabled)")
+    return NO_ANSWER
+
+async def _fetch_hedged(body, model):
+    tried = set()
+    primary = asyncio.ensure_future(_fetch_with_failover(body, tried, model))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=hedge_threshold())
+        if done or hedge_rate() >= config.GEMINI_HEDGE_MAX_RATE or key_pool.available() <= len(tried):
+            return await primary
+
+        hedge_stats["hedged"] += 1
+        hedge = asyncio.ensure_future(_fetch_with_failover(body, tried, model))
+        tasks.append(hedge)
+        pending = {primary, hedge}
+        answer = NO_ANSWER
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                answer = task.result()
+                if answer != NO_ANSWER:
+                    if task is hedge:
+                        hedge_stats["hedge_wins"] += 1
+                    return answer
+        return answer
+    finally:
+        # also when the caller is cancelled mid-wait: no request outlives it
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def fetch_scored_answer(prompt, generation_config=None, model=None):
+    # -> (reply text or "No answer", confidence or None)
+    body = build_request(prompt, generation_config)
+    model = model or config.GEMINI_MODEL
+    async with _get_semaphore():
+        hedge_stats["requests"] += 1
+        if config.GEMINI_HEDGE and len(key_pool.keys) > 1:
+            return await _fetch_hedged(body, model)
+        return await _fetch_with_failover(body, set(), model)
+
+async def fetch_answer_from_gemini(prompt: str, generation_config=None, model=None) -> str:
+    reply, _ = await fetch_scored_answer(prompt, generation_config, model)
+    return reply
+
+
+# --------------------- Metrics Export ---------------------
+def _key_pool_gauges():
+    for state in key_pool.snapshot():
+        labels = {"key": state["key"]}
+        yield "gemini_key_healthy", labels, int(state["healthy"])
+        yield "gemini_key_in_flight", labels, state["in_flight"]
+        yield "gemini_key_cooldown_seconds", labels, state["cooldown_remaining"]
+        yield "gemini_key_error_rate", labels, state["error_rate"]
+
+metrics.register_collector(_key_pool_gauges)
+metrics.register_stats("gemini_hedge", get_hedge_stats)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+from telethon import utils
+from telethon.tl.types import User
+
+# "@name" targets are usernames (5-32 letters, digits and underscores); bare
+# names are always matched against the titles of the account's own dialogs
+_username_re = re.compile(r"^@[a-z][a-z0-9_]{4,31}$")
+
+
+# --------------------- Group Resolver ---------------------
+# TARGET_GROUPS entries are resolved to peer ids once and kept in a JSON file
+# in the session folder. Later starts use the stored ids immediately; "@name"
+# targets that are not stored are looked up with get_entity (and only kept if
+# the account is a member), and only what is still missing costs a dialog
+# scan. A background refresh rescans every
+# interval and updates the live group dict in place, so handlers pick up
+# renamed or newly joined groups without a restart.
+class GroupResolver:
+    def __init__(self, targets, cache_path):
+        self.targets = list(targets)
+        self.cache_path = cache_path
+        self.entries = {}  # target -> {"id", "name", "resolved_at"}
+        self.listeners = []  # called with the group dict after a refresh changed it
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"⚠️ Ignoring group cache {cache_path}: {e}")
+        # older versions looked bare names up as usernames too, which could pick
+        # a public group the account never joined; resolve those from the dialogs again
+        stale = [t for t, e in self.entries.items() if not t.startswith("@") and e.get("via") != "dialogs"]
+        for target in stale:
+            del self.entries[target]
+        if stale:
+            logging.info(f"🧹 Re-resolving {len(stale)} cached group(s) from the dialog list")
+
+    def _save(self):
+        tmp = self.cache_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            logging.warning(f"⚠️ Could not save group cache: {e}")
+
+    def _store(self, target, peer_id, name, via):
+        self.entries[target] = {"id": peer_id, "name": name, "via": via, "resolved_at": round(time.time())}
+
+    async def _lookup_username(self, client, target):
+        try:
+            entity = await client.get_entity(target.lstrip("@"))
+        except (ValueError, TypeError) as e:
+            logging.debug(f"Username lookup for '{target}' failed: {e}")
+            return None
+        except Exception as e:
+            logging.warning(f"⚠️ Username lookup for '{target}' failed: {e}")
+            return None
+        if isinstance(entity, User) or getattr(entity, "left", False):
+            return None  # not a group, or one this account is not in
+        return utils.get_peer_id(entity), getattr(entity, "title", target)
+
+    async def _scan(self, client, targets):
+        # one pass over the dialogs for every target still unresolved
+        found = {}
+        scanned = 0
+        wanted = [(target, target.lower()) for target in targets]
+        async for dialog in client.iter_dialogs():
+            scanned += 1
+            name = (dialog.name or "").lower()
+            username = (getattr(dialog.entity, "username", "") or "").lower()
+            for target, t in wanted:
+                if t in name or (username and username == t.lstrip("@")):
+                    found[target] = (dialog.id, dialog.name)
+        return found, scanned
+
+    async def resolve(self, client, use_cache=True, verbose=True):
+        start = time.monotonic()
+        groups = {}
+        if use_cache:
+            for target in self.targets:
+                entry = self.entries.get(target)
+                if entry is not None:
+                    groups[target] = entry["id"]
+        cached = len(groups)
+
+        missing = [t for t in self.targets if t not in groups]
+        usernames = [t for t in missing if _username_re.match(t.lower())]
+        looked_up = 0
+        if usernames:
+            results = await asyncio.gather(*(self._lookup_username(client, t) for t in usernames))
+            for target, result in zip(usernames, results):
+                if result is not None:
+                    groups[target] = result[0]
+                    self._store(target, *result, via="username")
+                    looked_up += 1
+            missing = [t for t in missing if t not in groups]
+
+        scanned = 0
+        if missing:
+            found, scanned = await self._scan(client, missing)
+            for target, (peer_id, name) in found.items():
+                groups[target] = peer_id
+                self._store(target, peer_id, name, via="dialogs")
+
+        if verbose:
+            for target, peer_id in groups.items():
+                logging.info(f"✅ Found '{target}' ({peer_id})")
+            for target in self.targets:
+                if target not in groups:
+                    logging.warning(f"⚠️ Target group '{target}' not found")
+        logging.log(
+            logging.INFO if verbose else logging.DEBUG,
+            f"🔎 Resolved {len(groups)}/{len(self.targets)} groups in {time.monotonic() - start:.2f}s "
+            f"(cached {cached}, username lookups {looked_up}, dialogs scanned {scanned})"
+        )
+        if looked_up or scanned:
+            self._save()
+        return groups
+
+    def _apply(self, groups, fresh):
+        # update `groups` in place and tell the listeners
+        if fresh == groups:
+            return
+        added = {t: i for t, i in fresh.items() if groups.get(t) != i}
+        removed = [t for t in groups if t not in fresh]
+        logging.info(f"🔄 Groups updated: changed {added or '{}'}, removed {removed or '[]'}")
+        groups.clear()
+        groups.update(fresh)
+        for listener in self.listeners:
+            listener(groups)
+
+    async def refresh_forever(self, client, groups, interval):
+        # revalidate with a full scan and update `groups` in place
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                fresh = await self.resolve(client, use_cache=False, verbose=False)
+            except Exception as e:
+                logging.warning(f"⚠️ Group refresh failed: {e}")
+                continue
+            if not fresh:
+                continue  # keep the old set rather than going deaf
+            self._apply(groups, fresh)
+            for target in list(self.entries):
+                if target not in fresh and target in self.targets:
+                    del self.entries[target]
+            self._save()
+
+    async def retarget(self, client, groups, targets):
+        # TARGET_GROUPS changed at runtime: cached targets apply at once, new
+        # ones are looked up, and `groups` is updated in place
+        self.targets = list(targets)
+        fresh = await self.resolve(client)
+        if not fresh:
+            logging.warning("⚠️ None of the new TARGET_GROUPS were found; keeping the current groups")
+            return
+        self._apply(groups, fresh)
@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+
+from google import genai
+
+
+# --------------------- Gemini Key ---------------------
+class GeminiKey:
+    def __init__(self, index, api_key):
+        self.index = index
+        self.api_key = api_key
+        self.healthy = True
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.error_rate = 0.0  # EWMA over recent requests
+        self.last_error = None
+        self._sdk_client = None
+
+    @property
+    def label(self):
+        return f"{self.index + 1}: {self.api_key[:6]}***"
+
+    def sdk_client(self):
+        # built once per key, only used by the blocking SDK fallback
+        if self._sdk_client is None:
+            self._sdk_client = genai.Client(api_key=self.api_key)
+        return self._sdk_client
+
+    def snapshot(self, now):
+        return {
+            "key": self.label,
+            "healthy": self.healthy,
+            "cooldown_remaining": round(max(0.0, self.cooldown_until - now), 1),
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "error_rate": round(self.error_rate, 3),
+            "last_error": self.last_error,
+        }
+
+
+def error_status(error):
+    # GeminiError carries .status, google-genai APIError carries .code
+    status = getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(error, "code", None)
+    return status if isinstance(status, int) else None
+
+def is_bad_key_error(status, error):
+    if status in (401, 403):
+        return True
+    return status == 400 and "api key" in str(error).lower()
+
+def is_transient_error(status):
+    # timeouts, dropped connections (no status) and server errors say nothing
+    # about the key: fail over, but keep the key in rotation
+    return status is None or status == 408 or status >= 500
+
+def is_request_error(status, error):
+    # a 4xx about the request itself (bad argument, unknown model): every key
+    # would get the same answer, so no key is to blame
+    if status is None or not 400 <= status < 500 or status in (408, 429):
+        return False
+    return not is_bad_key_error(status, error)
+
+
+# --------------------- Key Pool ---------------------
+# Shared by every poll: picks the healthy key with the fewest requests in
+# flight, parks rate-limited keys for a cooldown window, backs off keys after
+# other key errors and retires keys the API rejects outright. Timeouts and 5xx
+# only count against the key; the caller fails over to another one. Guarded by a lock because the SDK fallback reports
+# results from worker threads.
+class KeyPool:
+    def __init__(self, api_keys, rate_limit_cooldown=30.0, error_cooldown=2.0, max_error_cooldown=60.0):
+        self.keys = [GeminiKey(i, k) for i, k in enumerate(api_keys)]
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.error_cooldown = error_cooldown
+        self.max_error_cooldown = max_error_cooldown
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def acquire(self, exclude=()):
+        now = time.monotonic()
+        with self._lock:
+            ready = [
+                k for k in self.keys
+                if k.healthy and k.cooldown_until <= now and k.index not in exclude
+            ]
+            if not ready:
+                return None
+            # least in-flight first, round-robin among equals
+            n = len(self.keys)
+            key = min(ready, key=lambda k: (k.in_flight, (k.index - self._next) % n))
+            self._next = (key.index + 1) % n
+            key.in_flight += 1
+            return key
+
+    def release(self, key, error=None, retry_after=None, cancelled=False):
+        now = time.monotonic()
+        with self._lock:
+            key.in_flight = max(0, key.in_flight - 1)
+            if cancelled:
+                return
+            status = error_status(error) if error is not None else None
+            if error is not None and is_request_error(status, error):
+                key.last_error = str(error)[:200]
+                return
+            if error is None:
+                key.successes += 1
+                key.consecutive_failures = 0
+                key.error_rate *= 0.8
+                key.last_error = None
+                return
+
+            key.failures += 1
+            key.error_rate = key.error_rate * 0.8 + 0.2
+            key.last_error = str(error)[:200]
+            if is_transient_error(status):
+                return
+            key.consecutive_failures += 1
+            if status == 429:
+                key.rate_limited += 1
+                cooldown = retry_after or self.rate_limit_cooldown
+                key.cooldown_until = now + cooldown
+                logging.warning(f"⏳ Gemini key {key.label} rate-limited, cooling down {cooldown:.0f}s")
+            elif is_bad_key_error(status, error):
+                key.healthy = False
+                logging.error(f"🚫 Gemini key {key.label} rejected by API, removed from rotation")
+            else:
+                cooldown = min(self.error_cooldown * 2 ** (key.consecutive_failures - 1), self.max_error_cooldown)
+                key.cooldown_until = now + cooldown
+                logging.warning(f"⚠️ Gemini key {key.label} failed, cooling down {cooldown:.1f}s")
+
+    def set_keys(self, api_keys):
+        # swap in a new key list, keeping the state of keys that stay; returns
+        # the keys that are new. Requests in flight on a removed key finish normally.
+        with self._lock:
+            current = {k.api_key: k for k in self.keys}
+            keys, added = [], []
+            for i, api_key in enumerate(api_keys):
+                key = current.get(api_key)
+                if key is None:
+                    key = GeminiKey(i, api_key)
+                    added.append(key)
+                key.index = i
+                keys.append(key)
+            self.keys = keys
+            self._next = 0
+        return added
+
+    def mark(self, key, healthy, reason=None, cooldown=None):
+        with self._lock:
+            key.healthy = healthy
+            if reason:
+                key.last_error = str(reason)[:200]
+            if cooldown:
+                key.cooldown_until = time.monotonic() + cooldown
+
+    def available(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for k in self.keys if k.healthy and k.cooldown_until <= now)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return [k.snapshot(now) for k in self.keys]
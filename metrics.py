@@ -0,0 +1,261 @@
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+
+# --------------------- Poll Trace ---------------------
+# One trace per poll event, carried through the pipeline in a context var so
+# helpers (cache, engine, voting) can time their own stage. Finished traces
+# are handed to every registered sink.
+_current_trace = contextvars.ContextVar("poll_trace", default=None)
+trace_sinks = []
+
+
+class PollTrace:
+    def __init__(self, chat_id=None, msg_id=None, sent_at=None):
+        self.chat_id = chat_id
+        self.msg_id = msg_id
+        self.started = time.monotonic()
+        # Telegram stamps messages with whole seconds, so this is coarse
+        self.receipt_lag = max(0.0, time.time() - sent_at.timestamp()) if sent_at else None
+        self.stages = {}
+        self.total = None
+        self.deadline = None  # monotonic close time, set by the handler
+        self.message = None   # the poll message, for the recorder
+        self.answer = None    # chosen option index
+        self.source = None    # where the answer came from (cache, bank, model, deadline)
+        self.model = None     # model (cascade tier) that produced the answer
+
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.monotonic() - start
+
+    def finish(self):
+        if self.total is None:
+            self.total = time.monotonic() - self.started
+            for sink in trace_sinks:
+                sink(self)
+        return self.total
+
+
+def start_trace(chat_id=None, msg_id=None, sent_at=None):
+    trace = PollTrace(chat_id, msg_id, sent_at)
+    _current_trace.set(trace)
+    return trace
+
+def activate_trace(trace):
+    # continue a trace started elsewhere (e.g. in the handler that queued it)
+    _current_trace.set(trace)
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def stage(name):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+    else:
+        with trace.stage(name):
+            yield
+
+
+# --------------------- Counters & Histograms ---------------------
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> Histogram
+_stats_sources = {}  # prefix -> fn returning {field: number}
+_collectors = []  # fn returning [(name, labels dict, value)]
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, value=1, **labels):
+    key = (name, _label_key(labels))
+    _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    key = (name, _label_key(labels))
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = Histogram(buckets)
+    hist.observe(value)
+
+def register_stats(prefix, fn):
+    # exports every numeric field of fn() as a gauge named <prefix>_<field>
+    _stats_sources[prefix] = fn
+
+def unregister_stats(prefix, fn):
+    # only if `fn` is still the source: a replacement may already have registered
+    if _stats_sources.get(prefix) == fn:
+        del _stats_sources[prefix]
+
+def register_collector(fn):
+    _collectors.append(fn)
+
+def unregister_collector(fn):
+    if fn in _collectors:
+        _collectors.remove(fn)
+
+def record_trace(trace):
+    observe("poll_total_seconds", trace.total)
+    if trace.receipt_lag is not None:
+        observe("poll_receipt_lag_seconds", trace.receipt_lag)
+    for name, seconds in trace.stages.items():
+        observe("poll_stage_seconds", seconds, stage=name)
+    inc("polls_total")
+
+trace_sinks.append(record_trace)
+
+
+# --------------------- Exposition ---------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _gauges():
+    for prefix, fn in _stats_sources.items():
+        try:
+            stats = fn()
+        except Exception:
+            continue
+        for field, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f"{prefix}_{field}", (), value
+    for fn in _collectors:
+        try:
+            for name, labels, value in fn():
+                yield name, _label_key(labels), value
+        except Exception:
+            continue
+
+def render_prometheus(prefix="quiz"):
+    lines = []
+    seen = set()
+    for (name, labels), value in sorted(_counters.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            seen.add(name)
+        lines.append(f"{prefix}_{name}{_fmt_labels(labels)} {value}")
+    for (name, labels), hist in sorted(_histograms.items(), key=lambda item: item[0]):
+        if name not in seen:
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            seen.add(name)
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f"{prefix}_{name}_bucket{_fmt_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{prefix}_{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {hist.count}")
+        lines.append(f"{prefix}_{name}_sum{_fmt_labels(labels)} {hist.sum}")
+        lines.append(f"{prefix}_{name}_count{_fmt_labels(labels)} {hist.count}")
+    # a metric family must be contiguous, so group gauges by name first
+    gauges = {}
+    for name, labels, value in _gauges():
+        gauges.setdefault(name, []).append((labels, value))
+    for name, samples in gauges.items():
+        if name not in seen:
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            seen.add(name)
+        for labels, value in samples:
+            lines.append(f"{prefix}_{name}{_fmt_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    return {
+        "counters": {f"{n}{_fmt_labels(l)}": v for (n, l), v in _counters.items()},
+        "histograms": {
+            f"{n}{_fmt_labels(l)}": {"count": h.count, "sum": round(h.sum, 6)}
+            for (n, l), h in _histograms.items()
+        },
+        "gauges": {f"{n}{_fmt_labels(l)}": v for n, l, v in _gauges()},
+    }
+
+
+# --------------------- HTTP Endpoint ---------------------
+async def start_metrics_server(host="127.0.0.1", port=9464):
+    from aiohttp import web
+
+    async def metrics_handler(request):
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def stats_handler(request):
+        return web.json_response(snapshot())
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/stats", stats_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"📊 Metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+# --------------------- JSONL Dump ---------------------
+class JsonlTraceWriter:
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def __call__(self, trace):
+        self._file.write(json.dumps({
+            "ts": round(time.time(), 3),
+            "chat_id": trace.chat_id,
+            "msg_id": trace.msg_id,
+            "total": round(trace.total, 6),
+            "stages": {k: round(v, 6) for k, v in trace.stages.items()},
+        }) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+async def start_metrics(host, port, jsonl_path=None):
+    runner = None
+    if port:
+        try:
+            runner = await start_metrics_server(host, port)
+        except OSError as e:
+            logging.warning(f"⚠️ Metrics endpoint not started on {host}:{port}: {e}")
+    writer = None
+    if jsonl_path:
+        writer = JsonlTraceWriter(jsonl_path)
+        trace_sinks.append(writer)
+    return runner, writer
+
+async def stop_metrics(handles):
+    runner, writer = handles
+    if writer is not None:
+        trace_sinks.remove(writer)
+        writer.close()
+    if runner is not None:
+        await runner.cleanup()
@@ -4,22 +4,35 @@ import os
 import logging
 import qrcode
 from colorama import init
-from google import genai
 import aiohttp
 import certifi
+import signal
 import ssl
 import time
 import random
 from telethon import TelegramClient, events
-from telethon.tl.types import MessageMediaPoll
-from telethon.tl.functions.messages import SendVoteRequest
+from telethon.tl.types import UpdateMessagePoll
+import config
 from config import *
+from answer_cache import AnswerCache
+from answer_engine import AnswerError, CascadeEngine, create_engine
+from deadlines import DeadlineGate, LatencyEstimate, poll_deadline
+from display import start_console
+from group_resolver import GroupResolver
+from gemini_engine import probe_gemini_keys, close_gemini_transport, reload_gemini_keys
+from metrics import inc, register_stats, stage, start_metrics, start_trace, stop_metrics
+from question_bank import load_question_bank
+from quiz_results import QuizResults
+from recorder import PollRecorder
+from resource_monitor import ResourceSampler
+from runtime_config import ConfigError, ConfigWatcher
+from scheduler import PollQueue
+from update_filter import POLL_UPDATES, poll_message
+from voter import Voter
 
 # Rich UI
 from rich.console import Console
 from rich.panel import Panel
-from rich.spinner import Spinner
-from rich.live import Live
 from rich.text import Text
 from rich import box
 
@@ -37,34 +50,51 @@ if sys.platform == "win32":
 os.makedirs(SESSION_FOLDER, exist_ok=True)
 ssl_context = ssl.create_default_context(cafile=certifi.where())
 
-# 🌌 Gemini client manager with fallback
-gemini_client = None
-current_gemini_index = 0
+# 💾 Answer cache (in-memory LRU over SQLite, keyed by question content)
+answer_cache = AnswerCache(
+    os.path.join(SESSION_FOLDER, ANSWER_CACHE_DB),
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+)
 
-def init_gemini_client():
-    global gemini_client, current_gemini_index
-    for i, key in enumerate(GEMINI_API_KEYS):
-        try:
-            client = genai.Client(api_key=key)
-            # quick test call
-            client.models.generate_content(model=GEMINI_MODEL, contents=[{"text":"Test"}])
-            gemini_client = client
-            current_gemini_index = i
-            logging.info(f"✅ Using Gemini API key {i+1}: {key[:6]}***")
-            return
-        except Exception as e:
-            logging.warning(f"❌ Gemini API key {i+1} failed: {key[:6]}*** | {e}")
-    raise Exception("❌ All Gemini API keys failed!")
+register_stats("answer_cache", answer_cache.stats)
+
+# 📖 Revealed quiz answers correct the cache and measure real accuracy per group
+quiz_results = QuizResults(
+    answer_cache,
+    os.path.join(SESSION_FOLDER, QUIZ_STATS_FILE),
+    min_samples=QUIZ_ACCURACY_MIN_SAMPLES,
+)
+
+# 📚 Question bank (known questions, exact or reworded, answered without the model)
+question_bank = load_question_bank(QUESTION_BANK_PATH, QUESTION_BANK_THRESHOLD) if QUESTION_BANK_PATH else None
+if question_bank is not None:
+    register_stats("question_bank", question_bank.stats)
+
+# ⏰ Model admission: earliest poll deadline first once GEMINI_CONCURRENCY answers are in flight
+model_gate = DeadlineGate(GEMINI_CONCURRENCY)
+model_latency = LatencyEstimate()
+register_stats("model_gate", model_gate.stats)
+
+# 🧵 Poll queue: handlers only enqueue, a fixed worker pool answers (round-robin across groups)
+poll_queue = PollQueue(QUEUE_WORKERS, QUEUE_MAX_SIZE, QUEUE_DROP_POLICY)
+register_stats("poll_queue", poll_queue.stats)
+
+# 🩺 Process resources (RSS, asyncio tasks, threads) exported as process_* gauges
+resource_sampler = ResourceSampler(RESOURCE_SAMPLE_INTERVAL, trace_frames=RESOURCE_TRACEMALLOC_FRAMES)
+register_stats("process", resource_sampler.stats)
+
+# 📼 Optional log of the live poll stream, replayable offline with replay.py
+poll_recorder = PollRecorder(RECORD_POLLS_PATH) if RECORD_POLLS_PATH else None
 
-init_gemini_client()
+# 🧠 Answer engine ("gemini", or "local" for offline runs)
+answer_engine = create_engine(ANSWER_ENGINE)
 
-# 🔄 Switch to next Gemini API key
-def switch_gemini_key():
-    global current_gemini_index, gemini_client
-    next_index = (current_gemini_index + 1) % len(GEMINI_API_KEYS)
-    gemini_client = genai.Client(api_key=GEMINI_API_KEYS[next_index])
-    current_gemini_index = next_index
-    logging.warning(f"🔄 Switched to Gemini API key {next_index+1}: {GEMINI_API_KEYS[next_index][:6]}***")
+def expected_model_latency():
+    # a cascade only escalates when there is time left, so only its first tier has to fit
+    if isinstance(answer_engine, CascadeEngine):
+        return answer_engine.latency[0].value()
+    return model_latency.value()
 
 # 🌈 Banner
 def gemini_banner():
@@ -75,30 +105,15 @@ def gemini_banner():
     ])
     console.print(Panel(Text(banner, style=random.choice(["bold magenta","bold cyan","bold green"])), style="bold blue", box=box.DOUBLE_EDGE))
 
-# 🧠 Gemini Answer Fetching with runtime fallback
-def fetch_answer_from_gemini_sync(prompt: str) -> str:
-    global gemini_client
-    for attempt in range(len(GEMINI_API_KEYS)):
-        try:
-            short_prompt = f"Q:\n{prompt}\n\nReply only with the correct option number."
-            response = gemini_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=[{"text": short_prompt if FAST_MODE else prompt}]
-            )
-            return response.text.strip()
-        except Exception as e:
-            logging.error(f"Gemini API error: {e}. Attempting next key...")
-            switch_gemini_key()
-    return "No answer"
-
-async def fetch_answer_from_gemini(prompt: str) -> str:
-    return await asyncio.to_thread(fetch_answer_from_gemini_sync, prompt)
-
-async def fetch_quiz_answer(prompt: str):
-    with Live(Spinner("dots", text="🧠 Gemini thinking...", style="bold cyan"), refresh_per_second=12):
-        start = time.time()
-        answer = await fetch_answer_from_gemini(prompt)
-        return answer or "No answer", round(time.time() - start, 2)
+# 🧠 Gemini Answer Fetching
+async def fetch_quiz_answer(question, options):
+    start = time.time()
+    try:
+        idx = await answer_engine.answer(question, options)
+    except AnswerError as e:
+        logging.error(f"❌ {answer_engine.name} engine failed: {e}")
+        idx = None
+    return idx, round(time.time() - start, 2)
 
 # 🎨 Poll display
 def print_poll_console(question, options, correct_index, confidence, duration):
@@ -108,11 +123,14 @@ def print_poll_console(question, options, correct_index, confidence, duration):
         style = "[bold green]" if i - 1 == correct_index else "[dim]"
         lines.append(f"{style}{prefix}{i}. {opt}[/]")
 
-    bar = "█" * int(confidence / 10) + "░" * (10 - int(confidence / 10))
+    # measured from revealed quiz answers; None until enough results are in
+    filled = int(confidence / 10) if confidence is not None else 0
+    bar = "█" * filled + "░" * (10 - filled)
+    accuracy = f"{confidence:.1f}%" if confidence is not None else "measuring…"
     console.print(
         Panel(
             f"[white]Q:[/] {question}\n\n" + "\n".join(lines) +
-            f"\n\n[cyan]Accuracy:[/] {confidence:.1f}%\n[green]{bar}[/green]\n[dim]⏱ Gemini reasoning: {duration:.2f}s[/dim]",
+            f"\n\n[cyan]Accuracy:[/] {accuracy}\n[green]{bar}[/green]\n[dim]⏱ Gemini reasoning: {duration:.2f}s[/dim]",
             title="🧩 Gemini Poll Analysis",
             border_style="bright_magenta",
             box=box.ROUNDED,
@@ -120,54 +138,106 @@ def print_poll_console(question, options, correct_index, confidence, duration):
     )
 
 # 🧩 Get poll answer
-async def get_poll_answer(question, options):
-    opt_text = "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(options)])
-    prompt = f"Question: {question}\nOptions:\n{opt_text}\nReturn only the correct option number:"
-    answer, duration = await fetch_quiz_answer(prompt)
-    import re
-    match = re.search(r'\d+', answer)
-    if match:
-        idx = int(match.group()) - 1
-        if 0 <= idx < len(options):
-            return idx, duration
-    return 0, duration
+async def get_poll_answer(question, options, deadline=None):
+    with stage("cache"):
+        cached = answer_cache.get(question, options)
+    if cached is not None:
+        return cached, 0.0, "cache"
+    if question_bank is not None:
+        with stage("bank"):
+            idx, _ = question_bank.lookup(question, options)
+        if idx is not None:
+            return idx, 0.0, "bank"
+    # only ask the model if the answer can still arrive before the poll closes
+    budget = None
+    if deadline is not None:
+        budget = deadline - time.monotonic() - DEADLINE_VOTE_MARGIN - expected_model_latency()
+        if budget <= 0:
+            inc("deadline_misses_total", stage="model")
+            return None, 0.0, "deadline"
+    with stage("admit"):
+        admitted = await model_gate.acquire(deadline, budget)
+    if not admitted:
+        inc("deadline_misses_total", stage="admit")
+        return None, 0.0, "deadline"
+    try:
+        with stage("model"):
+            idx, duration = await fetch_quiz_answer(question, options)
+    finally:
+        model_gate.release()
+    model_latency.observe(duration)
+    if idx is not None:
+        answer_cache.put(question, options, idx)
+    return idx, duration, "model"
+
+def poll_summary(question, options, correct_index, duration):
+    return f"🧩 {question} → {correct_index + 1}. {options[correct_index]} (⏱ {duration:.2f}s)"
+
+def print_reaction_timer(gemini_duration, vote_duration, total_reaction, vote_success):
+    console.print(
+        Panel(
+            f"⏱ Reaction Timer Dashboard\n\n"
+            f"Gemini reasoning: {gemini_duration:.2f}s\n"
+            f"Voting delay: {vote_duration:.2f}s\n"
+            f"Total reaction time: {total_reaction:.2f}s\n"
+            f"Vote success: {'✅' if vote_success else '❌'}",
+            title="⌛ Reaction Timer",
+            border_style="bright_yellow",
+            box=box.ROUNDED
+        )
+    )
 
 # 🗳️ Vote
-async def vote_poll(client, message, option_index):
-    try:
-        poll = message.media.poll
-        option = poll.answers[option_index].option
-        await client(SendVoteRequest(peer=message.peer_id, msg_id=message.id, options=[option]))
-        logging.info(f"✅ Auto-voted for option {option_index + 1}")
-        return True
-    except Exception as e:
-        if "closed" in str(e).lower():
-            logging.warning("⚠️ Poll closed before voting could complete.")
-        else:
-            logging.error(f"❌ Voting failed: {e}")
-        return False
-
-# 🔍 Find groups
+async def vote_poll(voter, message, option_index):
+    # outcome is counted and logged by the voter
+    return await voter.vote(message, option_index) == "ok"
+
+# 🔍 Find groups (peer ids cached in SESSION_FOLDER; dialogs are scanned only on a miss)
+group_resolver = GroupResolver(TARGET_GROUPS, os.path.join(SESSION_FOLDER, GROUP_CACHE_FILE))
+
 async def find_groups(client):
-    found = {}
-    async for dialog in client.iter_dialogs():
-        name = (dialog.name or "").lower()
-        username = (getattr(dialog.entity, "username", "") or "").lower()
-        for target in TARGET_GROUPS:
-            t = target.lower()
-            if t in name or username == t:
-                found[target] = dialog.id
-                logging.info(f"✅ Found '{target}' ({dialog.id})")
-    return found
+    return await group_resolver.resolve(client)
+
+# 🔧 Live config reload (speed, groups, keys, model)
+async def apply_runtime_config(changed, client, groups):
+    # called by the config watcher after it has set the new values on `config`
+    global answer_engine
+    if "TARGET_GROUPS" in changed:
+        await group_resolver.retarget(client, groups, config.TARGET_GROUPS)
+    if "GEMINI_API_KEYS" in changed:
+        await reload_gemini_keys(config.GEMINI_API_KEYS)
+    if {"GEMINI_MODEL", "GEMINI_MODEL_TIERS", "CASCADE_MIN_CONFIDENCE"} & set(changed):
+        # polls already with the old engine finish there
+        old, answer_engine = answer_engine, create_engine(ANSWER_ENGINE)
+        await old.close()
+        logging.info(f"🧠 Answer engine rebuilt for model(s) {config.GEMINI_MODEL_TIERS or [config.GEMINI_MODEL]}")
+
+# 📤 Send QR to bot
+async def send_qr_to_bot(bot_token, image_path, caption=None):
+    url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
+        with open(image_path, 'rb') as photo:
+            form = aiohttp.FormData()
+            form.add_field('photo', photo, filename="qr.png")
+            if caption:
+                form.add_field('caption', caption)
+            form.add_field('chat_id', str(777000))
+            try:
+                await session.post(url, data=form)
+                logging.info(f"📷 QR sent to bot with caption: {caption}")
+            except Exception as e:
+                logging.error(f"❌ Failed to send QR to bot: {e}")
 
 # 📷 QR/Mobile login with 2FA fallback
 async def login_with_qr_or_phone(index=0):
     session_file = os.path.join(SESSION_FOLDER, f"user{index}.session")
     client = TelegramClient(session_file, API_ID, API_HASH)
+    start = time.monotonic()
     await client.connect()
+    # the responder keeps using this connection, so this is the reconnect it no longer pays
+    logging.info(f"🔌 Telegram connected in {time.monotonic() - start:.2f}s (kept open for the responder)")
     if await client.is_user_authorized():
         logging.info(f"✅ User{index} authorized via existing session.")
-        await client.disconnect()
         return client
 
     img_path = f"qr_user{index}.png"
@@ -209,7 +279,6 @@ async def login_with_qr_or_phone(index=0):
             await client.disconnect()
             raise e
 
-    await client.disconnect()
     return client
 
 async def login_all_accounts():
@@ -222,68 +291,164 @@ async def login_all_accounts():
 async def responder_loop(client, groups):
     gemini_banner()
     console.print("[bold cyan]🤖 Gemini Auto-Responder (ultra-fast mode)[/bold cyan]\n")
+    # from here on all console output goes through the background worker
+    ui = start_console(HEADLESS, UI_FLUSH_INTERVAL)
+    register_stats("console", ui.stats)
+    voter = Voter(client, flood_max_wait=VOTE_FLOOD_MAX_WAIT)
+    await voter.prepare(groups.values())
 
-    @client.on(events.NewMessage(chats=list(groups.values())))
-    async def handler(event):
-        if not (event.message.media and isinstance(event.message.media, MessageMediaPoll)):
-            return
+    client.add_event_handler(quiz_results.handle_update, events.Raw(types=UpdateMessagePoll))
+
+    poll_queue.start()
+    if poll_recorder is not None:
+        poll_recorder.start()
+
+    # runs on a poll_queue worker
+    async def answer_poll(message, chat_id, deadline, trace):
         try:
-            poll = event.message.media.poll
-            q = poll.question.text if hasattr(poll.question, "text") else str(poll.question)
-            opts = [opt.text.text if hasattr(opt.text, "text") else str(opt.text) for opt in poll.answers]
+            with stage("extract"):
+                poll = message.media.poll
+                q = poll.question.text if hasattr(poll.question, "text") else str(poll.question)
+                opts = [opt.text.text if hasattr(opt.text, "text") else str(opt.text) for opt in poll.answers]
 
             poll_start = time.time()
-            idx, gemini_duration = await get_poll_answer(q, opts)
-            confidence = random.uniform(80, 95)
-            print_poll_console(q, opts, idx, confidence, gemini_duration)
+            idx, gemini_duration, source = await get_poll_answer(q, opts, deadline)
+            trace.answer, trace.source = idx, source
+            quiz_results.track(poll, chat_id, q, opts, idx, source, trace.model)
+            if idx is None:
+                inc("polls_unanswered_total")
+                if source == "deadline":
+                    logging.warning(f"⏰ No time left to answer '{q[:60]}' before it closes, skipped")
+                else:
+                    logging.warning(f"🤷 No valid answer for '{q[:60]}', not voting")
+                return
+            confidence = quiz_results.accuracy(chat_id)
+            with stage("render"):
+                ui.show(
+                    poll_summary(q, opts, idx, gemini_duration),
+                    lambda: print_poll_console(q, opts, idx, confidence, gemini_duration),
+                )
 
-            delay = SPEED_DELAY.get(ANSWER_SPEED, 0.2)
-            if FAST_MODE:
+            delay = config.SPEED_DELAY.get(config.ANSWER_SPEED, 0.2)
+            if config.FAST_MODE:
                 delay = min(0.2, delay / 2)
-            await asyncio.sleep(delay)
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic() - DEADLINE_VOTE_MARGIN))
+            with stage("delay"):
+                await asyncio.sleep(delay)
 
             vote_start = time.time()
             vote_success = False
-            if AUTO_TICK:
-                vote_success = await vote_poll(client, event.message, idx)
+            if deadline is not None and time.monotonic() >= deadline:
+                inc("deadline_misses_total", stage="vote")
+                logging.warning(f"⏰ '{q[:60]}' closed before the vote, skipped")
+            elif config.AUTO_TICK:
+                with stage("vote"):
+                    vote_success = await vote_poll(voter, message, idx)
             vote_end = time.time()
 
             total_reaction = vote_end - poll_start
-            console.print(
-                Panel(
-                    f"⏱ Reaction Timer Dashboard\n\n"
-                    f"Gemini reasoning: {gemini_duration:.2f}s\n"
-                    f"Voting delay: {vote_end - vote_start:.2f}s\n"
-                    f"Total reaction time: {total_reaction:.2f}s\n"
-                    f"Vote success: {'✅' if vote_success else '❌'}",
-                    title="⌛ Reaction Timer",
-                    border_style="bright_yellow",
-                    box=box.ROUNDED
+            vote_duration = vote_end - vote_start
+            with stage("render"):
+                ui.show(
+                    f"⌛ Vote {'✅' if vote_success else '❌'} | reasoning {gemini_duration:.2f}s | "
+                    f"voting {vote_duration:.2f}s | total {total_reaction:.2f}s",
+                    lambda: print_reaction_timer(gemini_duration, vote_duration, total_reaction, vote_success),
                 )
-            )
 
         except Exception as e:
             logging.error(f"Poll handler error: {e}")
+        finally:
+            trace.finish()
+
+    # only polls in the target groups get past this; checked on the raw update,
+    # before Telethon builds a NewMessage event for every chat message
+    chat_ids = frozenset(groups.values())
+
+    def on_groups_changed(groups):
+        nonlocal chat_ids
+        chat_ids = frozenset(groups.values())
+
+    group_resolver.listeners.append(on_groups_changed)
+
+    async def handler(update):
+        found = poll_message(update, chat_ids)
+        if found is None:
+            return
+        message, chat_id = found
+        trace = start_trace(chat_id, message.id, message.date)
+        trace.message = message
+        deadline = trace.deadline = poll_deadline(message)
+        poll_queue.submit(chat_id, deadline, trace, lambda: answer_poll(message, chat_id, deadline, trace))
+
+    client.add_event_handler(handler, events.Raw(types=POLL_UPDATES))
 
     await client.run_until_disconnected()
 
 # 🚀 Main
 async def main():
+    # systemd/docker stop send SIGTERM: unwind through the cleanup below like Ctrl-C
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows event loops have no signal handlers
+    startup = time.monotonic()
+    # Gemini keys are validated in the background while Telegram connects
+    key_probe = asyncio.create_task(probe_gemini_keys())
+    metrics_handles = await start_metrics(METRICS_HOST, METRICS_PORT, METRICS_JSONL_PATH)
+
+    # checked before login: a setting live reload cannot accept only turns live reload off
+    config_watcher = None
+    if CONFIG_RELOAD_INTERVAL:
+        try:
+            config_watcher = ConfigWatcher(config.__file__, CONFIG_RELOAD_INTERVAL)
+        except ConfigError as e:
+            logging.error(f"❌ Live config reload disabled: {e}")
+
+    # the login connection is handed straight to the responder: its update
+    # state and entity cache are already loaded, and no second handshake is needed
     client = await login_all_accounts()
-    session_file = os.path.join(SESSION_FOLDER, "user0.session")
-    client = TelegramClient(session_file, API_ID, API_HASH)
-    await client.start()
 
     groups = await find_groups(client)
     if not groups:
         logging.warning("⚠️ No groups found. Check TARGET_GROUPS.")
+        await client.disconnect()
+        key_probe.cancel()
+        await stop_metrics(metrics_handles)
+        await close_gemini_transport()
         return
 
+    probe_state = "done" if key_probe.done() else "still probing"
+    logging.info(f"⏱ Ready in {time.monotonic() - startup:.2f}s (Gemini keys: {probe_state})")
     logging.info("🚀 Bot running in multi-group ultra-fast mode")
-    await responder_loop(client, groups)
+    group_refresh = None
+    if GROUP_REFRESH_INTERVAL:
+        group_refresh = asyncio.create_task(group_resolver.refresh_forever(client, groups, GROUP_REFRESH_INTERVAL))
+    resource_sampling = None
+    if RESOURCE_SAMPLE_INTERVAL:
+        resource_sampling = asyncio.create_task(resource_sampler.run())
+    config_reload = None
+    if config_watcher is not None:
+        config_watcher.listeners.append(lambda changed: apply_runtime_config(changed, client, groups))
+        config_reload = asyncio.create_task(config_watcher.watch())
+    try:
+        await responder_loop(client, groups)
+    finally:
+        if config_reload is not None:
+            config_reload.cancel()
+        if resource_sampling is not None:
+            resource_sampling.cancel()
+        await poll_queue.close()
+        if poll_recorder is not None:
+            poll_recorder.close()
+        if group_refresh is not None:
+            group_refresh.cancel()
+        key_probe.cancel()
+        await stop_metrics(metrics_handles)
+        await close_gemini_transport()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logging.info("🛑 Stopped by user.")
@@ -0,0 +1,134 @@
+import contextvars
+import re
+import threading
+
+import config
+import metrics
+
+_space_re = re.compile(r"\s+")
+
+# The only instruction text; each request carries exactly one of these, first,
+# so every prompt shares the same prefix.
+SINGLE_INSTRUCTION = "Reply with the number of the correct option."
+BATCH_INSTRUCTION = "Reply with a JSON array of the correct option numbers, in order."
+
+
+# --------------------- Prompt Builder ---------------------
+# Compact encoding: whitespace collapsed, no "Question:"/"Options:" labels, one
+# line per option. The response schema already pins the reply format, so the
+# instruction is a single short sentence.
+def compact(text):
+    return _space_re.sub(" ", text or "").strip()
+
+def trim_option(text, limit=None):
+    limit = config.PROMPT_MAX_OPTION_CHARS if limit is None else limit
+    if limit and len(text) > limit:
+        return text[:limit - 1].rstrip() + "…"
+    return text
+
+def format_poll(question, options):
+    lines = [compact(question)]
+    lines.extend(f"{i}) {trim_option(compact(opt))}" for i, opt in enumerate(options, 1))
+    return "\n".join(lines)
+
+def single_prompt(question, options):
+    return f"{SINGLE_INSTRUCTION}\n{format_poll(question, options)}"
+
+def batch_prompt(items):
+    blocks = [f"Q{n}. {format_poll(q, o)}" for n, (q, o) in enumerate(items, 1)]
+    return BATCH_INSTRUCTION + "\n\n" + "\n\n".join(blocks)
+
+def estimate_tokens(text):
+    # rough 4-characters-per-token figure for engines without usage metadata
+    return max(1, (len(text) + 3) // 4)
+
+
+# --------------------- Token Accounting ---------------------
+# Usage comes from the response metadata of every successful model request and
+# is summed per key and per group (chat id). A batch is shared by several
+# groups, so its tokens are split evenly between them; the engine sets
+# `token_groups` around such requests, otherwise the poll's trace decides.
+token_groups = contextvars.ContextVar("token_groups", default=None)
+PROMPT_TOKEN_BUCKETS = (16, 32, 48, 64, 96, 128, 192, 256, 512, 1024, 2048)
+
+
+def current_group():
+    trace = metrics.current_trace()
+    return trace.chat_id if trace is not None and trace.chat_id is not None else "none"
+
+def request_groups():
+    return token_groups.get() or [current_group()]
+
+
+def _rounded(table):
+    return {str(name): {k: round(v, 1) for k, v in bucket.items()} for name, bucket in table.items()}
+
+
+class TokenUsage:
+    KINDS = ("prompt", "output", "thoughts")
+
+    def __init__(self):
+        self.requests = 0
+        self.totals = dict.fromkeys(self.KINDS, 0)
+        self.by_key = {}    # key label -> {kind: tokens, "requests": n}
+        self.by_group = {}  # chat id -> {kind: tokens, "requests": n}
+        # the SDK fallback records from worker threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bucket(table, name):
+        bucket = table.get(name)
+        if bucket is None:
+            bucket = table[name] = dict.fromkeys(TokenUsage.KINDS, 0)
+            bucket["requests"] = 0
+        return bucket
+
+    def record(self, key, usage, groups=None):
+        # usage: {"prompt": n, "output": n, "thoughts": n}
+        groups = groups or request_groups()
+        with self._lock:
+            self.requests += 1
+            key_bucket = self._bucket(self.by_key, key)
+            key_bucket["requests"] += 1
+            for group in groups:
+                self._bucket(self.by_group, group)["requests"] += 1
+            for kind in self.KINDS:
+                tokens = usage.get(kind) or 0
+                if not tokens:
+                    continue
+                self.totals[kind] += tokens
+                key_bucket[kind] += tokens
+                for group in groups:
+                    self._bucket(self.by_group, group)[kind] += tokens / len(groups)
+        for kind in self.KINDS:
+            tokens = usage.get(kind) or 0
+            if tokens:
+                metrics.inc("gemini_tokens_total", tokens, kind=kind, key=key)
+        metrics.observe("gemini_prompt_tokens", usage.get("prompt") or 0, buckets=PROMPT_TOKEN_BUCKETS)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.totals["prompt"],
+                "output_tokens": self.totals["output"],
+                "thoughts_tokens": self.totals["thoughts"],
+                "mean_prompt_tokens": round(self.totals["prompt"] / self.requests, 1) if self.requests else 0,
+            }
+
+    def report(self):
+        # per-key and per-group breakdown, for the bench report
+        with self._lock:
+            return {"by_key": _rounded(self.by_key), "by_group": _rounded(self.by_group)}
+
+    def group_gauges(self):
+        with self._lock:
+            rows = [(group, dict(bucket)) for group, bucket in self.by_group.items()]
+        for group, bucket in rows:
+            for kind in self.KINDS:
+                yield "gemini_group_tokens", {"group": group, "kind": kind}, round(bucket[kind], 1)
+
+
+token_usage = TokenUsage()
+metrics.register_stats("gemini_tokens", token_usage.stats)
+metrics.register_collector(token_usage.group_gauges)
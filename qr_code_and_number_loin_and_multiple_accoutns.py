@@ -4,22 +4,34 @@ import os
 import logging
 import qrcode
 from colorama import init
-from google import genai
 import aiohttp
 import certifi
+import signal
 import ssl
 import time
-import re
 from telethon import TelegramClient, events
-from telethon.tl.types import MessageMediaPoll
-from telethon.tl.functions.messages import SendVoteRequest
+from telethon.tl.types import UpdateMessagePoll
+import config
 from config import *
+from answer_cache import AnswerCache, SingleFlight
+from answer_engine import AnswerError, CascadeEngine, create_engine
+from deadlines import DeadlineGate, LatencyEstimate, poll_deadline
+from display import start_console
+from group_resolver import GroupResolver
+from gemini_engine import probe_gemini_keys, close_gemini_transport, reload_gemini_keys
+from metrics import inc, register_stats, stage, start_metrics, start_trace, stop_metrics
+from question_bank import load_question_bank
+from quiz_results import QuizResults
+from recorder import PollRecorder
+from resource_monitor import ResourceSampler
+from runtime_config import ConfigError, ConfigWatcher
+from scheduler import PollQueue
+from update_filter import POLL_UPDATES, poll_message
+from voter import Voter
 
 # Rich UI
 from rich.console import Console
 from rich.panel import Panel
-from rich.spinner import Spinner
-from rich.live import Live
 from rich.text import Text
 from rich import box
 
@@ -51,119 +63,153 @@ def gemini_banner():
         )
     )
 
-# --------------------- Gemini API Manager ---------------------
-gemini_client = None
-current_gemini_index = 0
-
-def init_gemini_client():
-    global gemini_client, current_gemini_index
-    for i, key in enumerate(GEMINI_API_KEYS):
-        try:
-            client = genai.Client(api_key=key)
-            client.models.generate_content(model=GEMINI_MODEL, contents=[{"text":"Test"}])
-            gemini_client = client
-            current_gemini_index = i
-            logging.info(f"✅ Using Gemini API key {i+1}: {key[:6]}***")
-            return
-        except Exception as e:
-            logging.warning(f"❌ Gemini API key {i+1} failed: {key[:6]}*** | {e}")
-    raise Exception("❌ All Gemini API keys failed!")
-
-def switch_gemini_key():
-    global current_gemini_index, gemini_client
-    next_index = (current_gemini_index + 1) % len(GEMINI_API_KEYS)
-    gemini_client = genai.Client(api_key=GEMINI_API_KEYS[next_index])
-    current_gemini_index = next_index
-    logging.warning(f"🔄 Switched to Gemini API key {next_index+1}: {GEMINI_API_KEYS[next_index][:6]}***")
-
-init_gemini_client()
-
 # --------------------- Poll Answer Cache ---------------------
-poll_answer_cache = {}  # key: chat_id:msg_id -> (correct_index, duration)
+# in-memory LRU over SQLite, keyed by question content (shared across groups and restarts)
+answer_cache = AnswerCache(
+    os.path.join(SESSION_FOLDER, ANSWER_CACHE_DB),
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+)
+poll_flight = SingleFlight()  # one pending Gemini request per chat_id:msg_id
+register_stats("answer_cache", answer_cache.stats)
+register_stats("poll_flight", poll_flight.stats)
+
+# --------------------- Quiz Results ---------------------
+# revealed quiz answers correct the cache and measure real accuracy per group
+quiz_results = QuizResults(
+    answer_cache,
+    os.path.join(SESSION_FOLDER, QUIZ_STATS_FILE),
+    min_samples=QUIZ_ACCURACY_MIN_SAMPLES,
+)
+
+# --------------------- Question Bank ---------------------
+# known questions, exact or reworded, are answered without asking the model
+question_bank = load_question_bank(QUESTION_BANK_PATH, QUESTION_BANK_THRESHOLD) if QUESTION_BANK_PATH else None
+if question_bank is not None:
+    register_stats("question_bank", question_bank.stats)
+
+# --------------------- Deadlines ---------------------
+# model admission: earliest poll deadline first once GEMINI_CONCURRENCY answers are in flight
+model_gate = DeadlineGate(GEMINI_CONCURRENCY)
+model_latency = LatencyEstimate()
+register_stats("model_gate", model_gate.stats)
+
+# --------------------- Poll Queue ---------------------
+# handlers only enqueue; a fixed worker pool shared by all accounts answers,
+# round-robin across groups
+poll_queue = PollQueue(QUEUE_WORKERS, QUEUE_MAX_SIZE, QUEUE_DROP_POLICY)
+register_stats("poll_queue", poll_queue.stats)
+
+# --------------------- Resources ---------------------
+# RSS, asyncio tasks and threads, exported as process_* gauges to catch slow leaks
+resource_sampler = ResourceSampler(RESOURCE_SAMPLE_INTERVAL, trace_frames=RESOURCE_TRACEMALLOC_FRAMES)
+register_stats("process", resource_sampler.stats)
+
+# --------------------- Poll Recorder ---------------------
+poll_recorder = PollRecorder(RECORD_POLLS_PATH) if RECORD_POLLS_PATH else None  # replay with replay.py
+
+# --------------------- Answer Engine ---------------------
+answer_engine = create_engine(ANSWER_ENGINE)  # "gemini", or "local" for offline runs
+
+def expected_model_latency():
+    # a cascade only escalates when there is time left, so only its first tier has to fit
+    if isinstance(answer_engine, CascadeEngine):
+        return answer_engine.latency[0].value()
+    return model_latency.value()
 
 # --------------------- Gemini Answer ---------------------
-def fetch_answer_from_gemini_sync(prompt: str) -> str:
-    global gemini_client
-    for _ in range(len(GEMINI_API_KEYS)):
-        try:
-            short_prompt = f"Q:\n{prompt}\n\nReply only with the correct option number."
-            response = gemini_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=[{"text": short_prompt if FAST_MODE else prompt}]
-            )
-            return response.text.strip()
-        except Exception as e:
-            logging.error(f"Gemini API error: {e}. Switching key...")
-            switch_gemini_key()
-    return "No answer"
-
-async def fetch_answer_from_gemini(prompt: str) -> str:
-    return await asyncio.to_thread(fetch_answer_from_gemini_sync, prompt)
-
-async def fetch_quiz_answer(prompt: str):
-    with Live(Spinner("dots", text="🧠 Gemini thinking...", style="bold cyan"), refresh_per_second=12):
-        start = time.time()
-        answer = await fetch_answer_from_gemini(prompt)
-        return answer or "No answer", round(time.time() - start, 2)
+async def fetch_quiz_answer(question, options):
+    start = time.time()
+    try:
+        idx = await answer_engine.answer(question, options)
+    except AnswerError as e:
+        logging.error(f"❌ {answer_engine.name} engine failed: {e}")
+        idx = None
+    return idx, round(time.time() - start, 2)
 
 # --------------------- Poll Display ---------------------
-def print_poll_console(question, options, correct_index, confidence=85, duration=0.0):
+def print_poll_console(question, options, correct_index, confidence=None, duration=0.0):
     lines = []
     for i, opt in enumerate(options, 1):
         prefix = "→ " if i - 1 == correct_index else "  "
         style = "[bold green]" if i - 1 == correct_index else "[dim]"
         lines.append(f"{style}{prefix}{i}. {opt}[/]")
 
-    bar = "█" * int(confidence / 10) + "░" * (10 - int(confidence / 10))
+    # measured from revealed quiz answers; None until enough results are in
+    filled = int(confidence / 10) if confidence is not None else 0
+    bar = "█" * filled + "░" * (10 - filled)
+    accuracy = f"{confidence:.1f}%" if confidence is not None else "measuring…"
     console.print(
         Panel(
             f"[white]Q:[/] {question}\n\n" + "\n".join(lines) +
-            f"\n\n[cyan]Accuracy:[/] {confidence:.1f}%\n[green]{bar}[/green]\n[dim]⏱ Gemini reasoning: {duration:.2f}s[/dim]",
+            f"\n\n[cyan]Accuracy:[/] {accuracy}\n[green]{bar}[/green]\n[dim]⏱ Gemini reasoning: {duration:.2f}s[/dim]",
             title="🧩 Gemini Poll Analysis",
             border_style="bright_magenta",
             box=box.ROUNDED,
         )
     )
 
+def poll_summary(question, options, correct_index, duration):
+    return f"🧩 {question} → {correct_index + 1}. {options[correct_index]} (⏱ {duration:.2f}s)"
+
 # --------------------- Get Poll Answer ---------------------
-async def get_poll_answer(question, options):
-    opt_text = "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(options)])
-    prompt = f"Question: {question}\nOptions:\n{opt_text}\nReturn only the correct option number:"
-    answer, duration = await fetch_quiz_answer(prompt)
-    match = re.search(r'\d+', answer)
-    if match:
-        idx = int(match.group()) - 1
-        if 0 <= idx < len(options):
-            return idx, duration
-    return 0, duration
+async def get_poll_answer(question, options, deadline=None):
+    with stage("cache"):
+        cached = answer_cache.get(question, options)
+    if cached is not None:
+        return cached, 0.0, "cache"
+    if question_bank is not None:
+        with stage("bank"):
+            idx, _ = question_bank.lookup(question, options)
+        if idx is not None:
+            return idx, 0.0, "bank"
+    # only ask the model if the answer can still arrive before the poll closes
+    budget = None
+    if deadline is not None:
+        budget = deadline - time.monotonic() - DEADLINE_VOTE_MARGIN - expected_model_latency()
+        if budget <= 0:
+            inc("deadline_misses_total", stage="model")
+            return None, 0.0, "deadline"
+    with stage("admit"):
+        admitted = await model_gate.acquire(deadline, budget)
+    if not admitted:
+        inc("deadline_misses_total", stage="admit")
+        return None, 0.0, "deadline"
+    try:
+        with stage("model"):
+            idx, duration = await fetch_quiz_answer(question, options)
+    finally:
+        model_gate.release()
+    model_latency.observe(duration)
+    if idx is not None:
+        answer_cache.put(question, options, idx)
+    return idx, duration, "model"
 
 # --------------------- Vote Poll ---------------------
-async def vote_poll(client, message, option_index):
-    try:
-        poll = message.media.poll
-        option = poll.answers[option_index].option
-        await client(SendVoteRequest(peer=message.peer_id, msg_id=message.id, options=[option]))
-        logging.info(f"✅ Auto-ticked option {option_index + 1}")
-        return True
-    except Exception as e:
-        if "closed" in str(e).lower():
-            logging.warning("⚠️ Poll closed before voting could complete.")
-        else:
-            logging.error(f"❌ Voting failed: {e}")
-        return False
+async def vote_poll(voter, message, option_index):
+    # outcome is counted and logged by the voter
+    return await voter.vote(message, option_index) == "ok"
 
 # --------------------- Find Groups ---------------------
+# peer ids are cached in SESSION_FOLDER; dialogs are scanned only on a miss
+group_resolver = GroupResolver(TARGET_GROUPS, os.path.join(SESSION_FOLDER, GROUP_CACHE_FILE))
+
 async def find_groups(client):
-    found = {}
-    async for dialog in client.iter_dialogs():
-        name = (dialog.name or "").lower()
-        username = (getattr(dialog.entity, "username", "") or "").lower()
-        for target in TARGET_GROUPS:
-            t = target.lower()
-            if t in name or username == t:
-                found[target] = dialog.id
-                logging.info(f"✅ Found '{target}' ({dialog.id})")
-    return found
+    return await group_resolver.resolve(client)
+
+# --------------------- Live Config Reload ---------------------
+async def apply_runtime_config(changed, client, groups):
+    # called by the config watcher after it has set the new values on `config`
+    global answer_engine
+    if "TARGET_GROUPS" in changed:
+        await group_resolver.retarget(client, groups, config.TARGET_GROUPS)
+    if "GEMINI_API_KEYS" in changed:
+        await reload_gemini_keys(config.GEMINI_API_KEYS)
+    if {"GEMINI_MODEL", "GEMINI_MODEL_TIERS", "CASCADE_MIN_CONFIDENCE"} & set(changed):
+        # polls already with the old engine finish there
+        old, answer_engine = answer_engine, create_engine(ANSWER_ENGINE)
+        await old.close()
+        logging.info(f"🧠 Answer engine rebuilt for model(s) {config.GEMINI_MODEL_TIERS or [config.GEMINI_MODEL]}")
 
 # --------------------- Send QR to Bot ---------------------
 async def send_qr_to_bot(bot_token, image_path, caption=None):
@@ -244,48 +290,154 @@ async def login_all_accounts_async(count):
 async def responder_loop(client, groups):
     gemini_banner()
     console.print(f"[cyan]🤖 Gemini Auto-Responder (with auto-tick) active![/cyan]\n")
+    # from here on all console output goes through the background worker
+    ui = start_console(HEADLESS, UI_FLUSH_INTERVAL)
+    register_stats("console", ui.stats)
+    voter = Voter(client, flood_max_wait=VOTE_FLOOD_MAX_WAIT)
+    await voter.prepare(groups.values())
 
-    @client.on(events.NewMessage)
-    async def handler(event):
-        if event.chat_id not in groups.values():
-            return
-        if event.message.media and isinstance(event.message.media, MessageMediaPoll):
-            poll = event.message.media.poll
-            question = poll.question if isinstance(poll.question, str) else poll.question.text
-            options = [
-                opt.text if isinstance(opt.text, str) else opt.text.text
-                for opt in poll.answers
-            ]
-
-            key = f"{event.chat_id}:{event.message.id}"
-            if key in poll_answer_cache:
-                correct_idx, duration = poll_answer_cache[key]
-            else:
-                correct_idx, duration = await get_poll_answer(question, options)
-                poll_answer_cache[key] = (correct_idx, duration)
-
-            print_poll_console(question, options, correct_idx, confidence=85, duration=duration)
+    client.add_event_handler(quiz_results.handle_update, events.Raw(types=UpdateMessagePoll))
+
+    poll_queue.start()
+    if poll_recorder is not None:
+        poll_recorder.start()
+
+    # runs on a poll_queue worker
+    async def answer_poll(message, chat_id, deadline, trace):
+        try:
+            with stage("extract"):
+                poll = message.media.poll
+                question = poll.question if isinstance(poll.question, str) else poll.question.text
+                options = [
+                    opt.text if isinstance(opt.text, str) else opt.text.text
+                    for opt in poll.answers
+                ]
+
+            # only the first caller's trace sees the cascade tier, so the
+            # model travels with the shared result to every waiter
+            async def ask():
+                return await get_poll_answer(question, options, deadline), trace.model
+
+            key = f"{chat_id}:{message.id}"
+            (correct_idx, duration, source), trace.model = await poll_flight.do(key, ask)
+            trace.answer, trace.source = correct_idx, source
+            quiz_results.track(poll, chat_id, question, options, correct_idx, source, trace.model)
+            if correct_idx is None:
+                inc("polls_unanswered_total")
+                if source == "deadline":
+                    logging.warning(f"⏰ No time left to answer '{question[:60]}' before it closes, skipped")
+                else:
+                    logging.warning(f"🤷 No valid answer for '{question[:60]}', not voting")
+                return
+
+            # read on the event loop; the render runs on the console thread
+            confidence = quiz_results.accuracy(chat_id)
+            with stage("render"):
+                ui.show(
+                    poll_summary(question, options, correct_idx, duration),
+                    lambda: print_poll_console(
+                        question, options, correct_idx, confidence=confidence, duration=duration,
+                    ),
+                )
 
             # Auto-tick correct answer
-            await vote_poll(client, event.message, correct_idx)
+            if deadline is not None and time.monotonic() >= deadline:
+                inc("deadline_misses_total", stage="vote")
+                logging.warning(f"⏰ '{question[:60]}' closed before the vote, skipped")
+                return
+            with stage("vote"):
+                await vote_poll(voter, message, correct_idx)
+        finally:
+            trace.finish()
+
+    # only polls in the target groups get past this; checked on the raw update,
+    # before Telethon builds a NewMessage event for every chat message
+    chat_ids = frozenset(groups.values())
+
+    def on_groups_changed(groups):
+        nonlocal chat_ids
+        chat_ids = frozenset(groups.values())
+
+    group_resolver.listeners.append(on_groups_changed)
+
+    async def handler(update):
+        found = poll_message(update, chat_ids)
+        if found is None:
+            return
+        message, chat_id = found
+        trace = start_trace(chat_id, message.id, message.date)
+        trace.message = message
+        deadline = trace.deadline = poll_deadline(message)
+        poll_queue.submit(chat_id, deadline, trace, lambda: answer_poll(message, chat_id, deadline, trace))
+
+    client.add_event_handler(handler, events.Raw(types=POLL_UPDATES))
 
     await client.run_until_disconnected()
 
 # --------------------- Main ---------------------
 async def main():
+    # systemd/docker stop send SIGTERM: unwind through the cleanup below like Ctrl-C
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows event loops have no signal handlers
     count = int(input("Enter number of accounts to login: "))
+    startup = time.monotonic()
+    # Gemini keys are validated in the background while Telegram logs in
+    key_probe = asyncio.create_task(probe_gemini_keys())
+    metrics_handles = await start_metrics(METRICS_HOST, METRICS_PORT, METRICS_JSONL_PATH)
+
+    # checked before login: a setting live reload cannot accept only turns live reload off
+    config_watcher = None
+    if CONFIG_RELOAD_INTERVAL:
+        try:
+            config_watcher = ConfigWatcher(config.__file__, CONFIG_RELOAD_INTERVAL)
+        except ConfigError as e:
+            logging.error(f"❌ Live config reload disabled: {e}")
     clients = await login_all_accounts_async(count)
     logging.info(f"✅ {len(clients)} account(s) logged in successfully.")
 
     all_groups = await find_groups(clients[0])
     if not all_groups:
         logging.error("❌ No target groups found. Exiting...")
+        key_probe.cancel()
+        await stop_metrics(metrics_handles)
+        await close_gemini_transport()
         return
 
-    await asyncio.gather(*(responder_loop(client, all_groups) for client in clients))
+    probe_state = "done" if key_probe.done() else "still probing"
+    logging.info(f"⏱ Ready in {time.monotonic() - startup:.2f}s (Gemini keys: {probe_state})")
+    group_refresh = None
+    if GROUP_REFRESH_INTERVAL:
+        # every responder shares all_groups, which the refresh updates in place
+        group_refresh = asyncio.create_task(
+            group_resolver.refresh_forever(clients[0], all_groups, GROUP_REFRESH_INTERVAL)
+        )
+    resource_sampling = None
+    if RESOURCE_SAMPLE_INTERVAL:
+        resource_sampling = asyncio.create_task(resource_sampler.run())
+    config_reload = None
+    if config_watcher is not None:
+        config_watcher.listeners.append(lambda changed: apply_runtime_config(changed, clients[0], all_groups))
+        config_reload = asyncio.create_task(config_watcher.watch())
+    try:
+        await asyncio.gather(*(responder_loop(client, all_groups) for client in clients))
+    finally:
+        if config_reload is not None:
+            config_reload.cancel()
+        if resource_sampling is not None:
+            resource_sampling.cancel()
+        await poll_queue.close()
+        if poll_recorder is not None:
+            poll_recorder.close()
+        if group_refresh is not None:
+            group_refresh.cancel()
+        key_probe.cancel()
+        await stop_metrics(metrics_handles)
+        await close_gemini_transport()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logging.info("🛑 Script stopped by user.")
@@ -0,0 +1,354 @@
+import argparse
+import bisect
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+from functools import lru_cache
+
+from answer_cache import normalize_text, question_key
+
+# Known questions answered before the model is asked. Exact matches use the
+# same normalized key as the answer cache; reworded reposts are found with a
+# MinHash/LSH index over character trigrams and accepted only when the
+# estimated similarity clears the threshold, the option sets mostly agree, both
+# questions have the same polarity ("which is NOT ...") and the stored answer
+# is one of the poll's options.
+#
+#   python question_bank.py build bank.csv          # writes bank.csv.qbi
+#   python question_bank.py lookup bank.csv "Capital of France?" Paris Rome Oslo
+
+INDEX_VERSION = 3
+INDEX_MAGIC = b"QBI\x00"
+INDEX_SUFFIX = ".qbi"
+NUM_HASHES = 32          # 16-bit MinHash values per question
+BANDS = 8                # LSH bands of 4 values -> candidates from ~0.6 similarity
+ROWS = NUM_HASHES // BANDS
+SHINGLE = 3
+OPTION_OVERLAP = 0.75    # shared options / larger option count for a fuzzy match
+
+
+# --------------------- Bank File ---------------------
+# CSV (question, options, answer) or JSONL ({"question", "options", "answer"}).
+# options are "|"-separated in CSV; answer is the option text, or its 1-based
+# number when no option reads like that. JSONL rows may give "answer_index"
+# (1-based) instead, for banks whose options are themselves numbers.
+def bank_rows(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row["question"], row["options"].split("|"), row["answer"]
+        else:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    if "answer_index" in row:
+                        yield row["question"], row["options"], int(row["answer_index"])
+                    else:
+                        yield row["question"], row["options"], row["answer"]
+
+def resolve_answer(options, answer):
+    # an explicit index (int) picks the option; text is matched against the
+    # options first, so "3" in ["2", "3", "4"] stays "3"
+    if isinstance(answer, int):
+        return options[answer - 1] if 1 <= answer <= len(options) else None
+    answer = str(answer)
+    normalized = normalize_text(answer)
+    if any(normalize_text(option) == normalized for option in options):
+        return answer
+    if answer.strip().isdigit() and 1 <= int(answer) <= len(options):
+        return options[int(answer) - 1]
+    return answer
+
+
+# --------------------- MinHash ---------------------
+def _key64(key):
+    return int(key[:16], 16)
+
+@lru_cache(maxsize=1 << 16)
+def _shingle_hashes(shingle):
+    # one 64-byte blake2b per shingle gives 32 independent 16-bit hashes
+    return struct.unpack("<32H", hashlib.blake2b(shingle.encode("utf-8"), digest_size=64).digest())
+
+_punct_re = re.compile(r"[^\w\s]")
+
+def fuzzy_text(normalized_question):
+    # punctuation only adds noise to the trigrams; the option-set and polarity
+    # checks guard the fuzzy match instead
+    return " ".join(_punct_re.sub(" ", normalized_question).split())
+
+def signature(text):
+    text = f" {text} "
+    shingles = {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+    return tuple(map(min, zip(*map(_shingle_hashes, shingles))))
+
+def _band_keys(sig):
+    for band in range(BANDS):
+        value = 0
+        for h in sig[band * ROWS:(band + 1) * ROWS]:
+            value = (value << 16) | h
+        yield band, value
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / NUM_HASHES
+
+
+# --------------------- Options & Polarity ---------------------
+_word_re = re.compile(r"\w+(?:'\w+)?")
+_NEGATIONS = {"not", "no", "never", "except", "cannot", "false", "incorrect", "untrue"}
+
+def negated(normalized_question):
+    # "which is NOT a prime" and "which is a prime" are near-identical text
+    # with opposite answers
+    return any(w in _NEGATIONS or w.endswith("n't") for w in _word_re.findall(normalized_question))
+
+def option_hashes(normalized_options):
+    return sorted({
+        int.from_bytes(hashlib.blake2b(o.encode("utf-8"), digest_size=8).digest(), "little")
+        for o in normalized_options
+    })
+
+
+# --------------------- Index ---------------------
+# Everything lives in flat typed arrays (sorted 64-bit keys + row ids), so a
+# pre-built index is read back as raw buffers instead of being re-hashed.
+# File layout: magic, a length-prefixed JSON header (array names, type codes
+# and lengths), the answers as a JSON list, then each array's raw bytes. Only
+# data is read; loading an index never runs code.
+ARRAYS = ("signatures", "option_hashes", "option_offsets", "negated", "exact_keys", "exact_rows")
+
+
+class QuestionBank:
+    def __init__(self, threshold=0.85):
+        self.threshold = threshold
+        self.answers = []                          # row -> normalized answer text
+        self.signatures = array("H")               # row * NUM_HASHES -> minhash
+        self.option_hashes = array("Q")            # option text hashes, sorted per row
+        self.option_offsets = array("I", [0])      # row -> start in option_hashes
+        self.negated = array("B")                  # row -> question is negated
+        self.exact_keys = array("Q")               # sorted question_key prefixes
+        self.exact_rows = array("I")
+        self.band_keys = [array("Q") for _ in range(BANDS)]
+        self.band_rows = [array("I") for _ in range(BANDS)]
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.answers)
+
+    @classmethod
+    def build(cls, rows, threshold=0.85):
+        bank = cls(threshold)
+        exact = []
+        bands = [[] for _ in range(BANDS)]
+        for question, options, answer in rows:
+            answer = resolve_answer(options, answer)
+            if answer is None:
+                logging.warning(f"⚠️ Bank answer index out of range for: {question[:60]}")
+                continue
+            row = len(bank.answers)
+            bank.answers.append(normalize_text(answer))
+            normalized = normalize_text(question)
+            sig = signature(fuzzy_text(normalized))
+            bank.signatures.extend(sig)
+            bank.option_hashes.extend(option_hashes(normalize_text(o) for o in options))
+            bank.option_offsets.append(len(bank.option_hashes))
+            bank.negated.append(negated(normalized))
+            exact.append((_key64(question_key(question, options)), row))
+            for band, value in _band_keys(sig):
+                bands[band].append((value, row))
+        exact.sort()
+        bank.exact_keys = array("Q", (k for k, _ in exact))
+        bank.exact_rows = array("I", (r for _, r in exact))
+        for band, pairs in enumerate(bands):
+            pairs.sort()
+            bank.band_keys[band] = array("Q", (k for k, _ in pairs))
+            bank.band_rows[band] = array("I", (r for _, r in pairs))
+        return bank
+
+    def _arrays(self):
+        named = [(name, getattr(self, name)) for name in ARRAYS]
+        named += [(f"band_keys{b}", self.band_keys[b]) for b in range(BANDS)]
+        named += [(f"band_rows{b}", self.band_rows[b]) for b in range(BANDS)]
+        return named
+
+    def save(self, path):
+        answers = json.dumps(self.answers, ensure_ascii=False).encode("utf-8")
+        header = json.dumps({
+            "version": INDEX_VERSION,
+            "num_hashes": NUM_HASHES,
+            "bands": BANDS,
+            "byteorder": sys.byteorder,
+            "answers_bytes": len(answers),
+            "arrays": [[name, a.typecode, a.itemsize, len(a)] for name, a in self._arrays()],
+        }).encode("utf-8")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(INDEX_MAGIC + struct.pack("<I", len(header)) + header + answers)
+            for _, a in self._arrays():
+                a.tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, threshold=0.85):
+        with open(path, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"{path} is not a question bank index (or an old one), rebuild it")
+            (size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(size))
+            if (header.get("version") != INDEX_VERSION or header.get("num_hashes") != NUM_HASHES
+                    or header.get("bands") != BANDS):
+                raise ValueError(f"{path} was built by an incompatible version, rebuild it")
+            bank = cls(threshold)
+            bank.answers = json.loads(f.read(header["answers_bytes"]))
+            expected = {name: a.typecode for name, a in bank._arrays()}
+            for name, typecode, itemsize, count in header["arrays"]:
+                if expected.get(name) != typecode or array(typecode).itemsize != itemsize:
+                    raise ValueError(f"{path}: unexpected array {name!r}, rebuild it")
+                a = array(typecode)
+                try:
+                    a.fromfile(f, count)
+                except EOFError:
+                    raise ValueError(f"{path} is truncated, rebuild it")
+                if header["byteorder"] != sys.byteorder:
+                    a.byteswap()
+                if name.startswith("band_keys"):
+                    bank.band_keys[int(name[9:])] = a
+                elif name.startswith("band_rows"):
+                    bank.band_rows[int(name[9:])] = a
+                else:
+                    setattr(bank, name, a)
+        if len(bank.option_offsets) != len(bank.answers) + 1:
+            raise ValueError(f"{path} is inconsistent, rebuild it")
+        return bank
+
+    def _find(self, keys, value):
+        i = bisect.bisect_left(keys, value)
+        while i < len(keys) and keys[i] == value:
+            yield i
+            i += 1
+
+    def _option_index(self, row, normalized_options):
+        try:
+            return normalized_options.index(self.answers[row])
+        except ValueError:
+            return None
+
+    def _same_options(self, row, poll_hashes):
+        stored = self.option_hashes[self.option_offsets[row]:self.option_offsets[row + 1]]
+        shared = sum(1 for h in stored if h in poll_hashes)
+        return shared >= OPTION_OVERLAP * max(len(stored), len(poll_hashes))
+
+    def lookup(self, question, options):
+        # returns (option index, similarity) or (None, 0.0)
+        normalized_options = [normalize_text(o) for o in options]
+        for i in self._find(self.exact_keys, _key64(question_key(question, options))):
+            idx = self._option_index(self.exact_rows[i], normalized_options)
+            if idx is not None:
+                self.exact_hits += 1
+                return idx, 1.0
+
+        normalized = normalize_text(question)
+        sig = signature(fuzzy_text(normalized))
+        polarity = negated(normalized)
+        poll_hashes = set(option_hashes(normalized_options))
+        best, best_score = None, 0.0
+        seen = set()
+        for band, value in _band_keys(sig):
+            for i in self._find(self.band_keys[band], value):
+                row = self.band_rows[band][i]
+                if row in seen:
+                    continue
+                seen.add(row)
+                if bool(self.negated[row]) != polarity or not self._same_options(row, poll_hashes):
+                    continue
+                idx = self._option_index(row, normalized_options)
+                if idx is None:
+                    continue
+                score = similarity(sig, self.signatures[row * NUM_HASHES:(row + 1) * NUM_HASHES])
+                if score > best_score:
+                    best, best_score = idx, score
+        if best is not None and best_score >= self.threshold:
+            self.fuzzy_hits += 1
+            return best, best_score
+        self.misses += 1
+        return None, 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self),
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+        }
+
+
+# --------------------- Loading ---------------------
+# A bank file is indexed once into <path>.qbi; later starts load the index as
+# long as it is newer than the bank. A .qbi path can also be given directly.
+_loaded = {}
+
+def load_question_bank(path, threshold=0.85):
+    if path in _loaded:
+        return _loaded[path]
+    start = time.monotonic()
+    if path.endswith(INDEX_SUFFIX):
+        bank, source = QuestionBank.load(path, threshold), "index"
+    else:
+        index_path = path + INDEX_SUFFIX
+        fresh = os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path)
+        bank = None
+        if fresh:
+            try:
+                bank, source = QuestionBank.load(index_path, threshold), "index"
+            except (ValueError, KeyError, OSError, struct.error) as e:
+                logging.warning(f"⚠️ Ignoring question bank index {index_path}: {e}")
+        if bank is None:
+            bank, source = QuestionBank.build(bank_rows(path), threshold), "bank file"
+            try:
+                bank.save(index_path)
+            except OSError as e:
+                logging.warning(f"⚠️ Could not write question bank index {index_path}: {e}")
+    logging.info(f"📚 Loaded {len(bank)} questions from {source} in {time.monotonic() - start:.2f}s")
+    _loaded[path] = bank
+    return bank
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a question bank index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="index a CSV/JSONL bank into a .qbi file")
+    build.add_argument("bank")
+    build.add_argument("-o", "--output", help="index path (default: <bank>.qbi)")
+    lookup = sub.add_parser("lookup", help="look up one question")
+    lookup.add_argument("bank", help="CSV/JSONL bank or .qbi index")
+    lookup.add_argument("question")
+    lookup.add_argument("options", nargs="+")
+    lookup.add_argument("--threshold", type=float, default=0.85)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.monotonic()
+        bank = QuestionBank.build(bank_rows(args.bank))
+        output = args.output or args.bank + INDEX_SUFFIX
+        bank.save(output)
+        print(f"Indexed {len(bank)} questions into {output} in {time.monotonic() - start:.1f}s")
+    else:
+        bank = load_question_bank(args.bank, args.threshold)
+        idx, score = bank.lookup(args.question, args.options)
+        if idx is None:
+            print("No confident match")
+            sys.exit(1)
+        print(f"{idx + 1}. {args.options[idx]} (similarity {score:.2f})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+    main()
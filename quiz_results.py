@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from telethon.tl.types import UpdateMessagePoll
+
+from metrics import inc, register_collector
+
+
+def poll_text(value):
+    # layer-dependent: plain str, or TextWithEntities with .text
+    return value if isinstance(value, str) else value.text
+
+
+def correct_option_index(option_bytes, results):
+    # quiz results carry `correct` on the right option once the poll is closed
+    # or this account has voted; None until then
+    if results is None or not results.results:
+        return None
+    for voters in results.results:
+        if voters.correct and voters.option in option_bytes:
+            return option_bytes.index(voters.option)
+    return None
+
+
+# --------------------- Quiz Results ---------------------
+# Every answered (or skipped) quiz poll is remembered by poll id. When Telegram
+# reveals the correct option the answer cache is corrected, and the outcome is
+# counted per group and per answer source ("model", "cache", "bank"), giving
+# the measured accuracy shown on the dashboard.
+class QuizResults:
+    def __init__(self, answer_cache, stats_path=None, min_samples=5, max_tracked=5000):
+        self.answer_cache = answer_cache
+        self.stats_path = stats_path
+        self.min_samples = min_samples
+        self.max_tracked = max_tracked
+        self._tracked = OrderedDict()  # poll_id -> (chat_id, question, options, option bytes, predicted, source, model)
+        self._settled = OrderedDict()  # poll_id -> correct index, so each reveal is counted once
+        self.learned = 0
+        self.counts = {}               # (chat_id, source) -> [correct, total]
+        self.model_counts = {}         # model (cascade tier) -> [correct, total], this run only
+        if stats_path and os.path.exists(stats_path):
+            try:
+                with open(stats_path, encoding="utf-8") as f:
+                    for row in json.load(f):
+                        self.counts[(row["chat_id"], row["source"])] = [row["correct"], row["total"]]
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"⚠️ Ignoring quiz stats file {stats_path}: {e}")
+        register_collector(self._gauges)
+
+    def track(self, poll, chat_id, question, options, predicted, source, model=None):
+        if not poll.quiz:
+            return
+        option_bytes = [a.option for a in poll.answers]
+        self._tracked[poll.id] = (chat_id, question, options, option_bytes, predicted, source, model)
+        self._tracked.move_to_end(poll.id)
+        while len(self._tracked) > self.max_tracked:
+            self._tracked.popitem(last=False)
+
+    def _settle(self, poll_id, correct):
+        self._settled[poll_id] = correct
+        while len(self._settled) > self.max_tracked:
+            self._settled.popitem(last=False)
+
+    def on_results(self, poll_id, results, poll=None):
+        # with several accounts every one of them receives the reveal
+        if poll_id in self._settled:
+            return self._settled[poll_id]
+        tracked = self._tracked.get(poll_id)
+        if tracked is not None:
+            correct = correct_option_index(tracked[3], results)
+            if correct is not None:
+                self._settle(poll_id, correct)
+                self._record(poll_id, correct)
+            return correct
+        # an untracked quiz (e.g. posted before startup) is still worth learning
+        if poll is None or not poll.quiz:
+            return None
+        correct = correct_option_index([a.option for a in poll.answers], results)
+        if correct is not None:
+            options = [poll_text(a.text) for a in poll.answers]
+            self._settle(poll_id, correct)
+            self.answer_cache.put(poll_text(poll.question), options, correct)
+            self.learned += 1
+        return correct
+
+    def _record(self, poll_id, correct):
+        chat_id, question, options, _, predicted, source, model = self._tracked.pop(poll_id)
+        if predicted != correct:
+            self.answer_cache.put(question, options, correct)
+            self.learned += 1
+        if predicted is None:
+            inc("results_total", outcome="skipped", source=source)
+            return
+        hit = predicted == correct
+        inc("results_total", outcome="correct" if hit else "wrong", source=source)
+        counts = self.counts.setdefault((chat_id, source), [0, 0])
+        counts[0] += hit
+        counts[1] += 1
+        if model is not None:
+            counts = self.model_counts.setdefault(model, [0, 0])
+            counts[0] += hit
+            counts[1] += 1
+        if not hit:
+            logging.info(f"📖 Learned correct answer {correct + 1} for '{question[:60]}' (had {predicted + 1})")
+        self._save()
+
+    def accuracy(self, chat_id=None, source=None):
+        # percentage, or None while there are fewer than min_samples results
+        correct = total = 0
+        for (c, s), (ok, n) in self.counts.items():
+            if (chat_id is None or c == chat_id) and (source is None or s == source):
+                correct += ok
+                total += n
+        if total < self.min_samples:
+            return None
+        return 100.0 * correct / total
+
+    def model_accuracy(self):
+        # model -> percentage (None below min_samples)
+        return {
+            model: 100.0 * ok / n if n >= self.min_samples else None
+            for model, (ok, n) in self.model_counts.items()
+        }
+
+    def _save(self):
+        if not self.stats_path:
+            return
+        rows = [
+            {"chat_id": c, "source": s, "correct": ok, "total": n}
+            for (c, s), (ok, n) in self.counts.items()
+        ]
+        tmp = self.stats_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(rows, f)
+            os.replace(tmp, self.stats_path)
+        except OSError as e:
+            logging.warning(f"⚠️ Could not save quiz stats: {e}")
+
+    def _gauges(self):
+        for (chat_id, source), (ok, n) in self.counts.items():
+            yield "answer_accuracy_ratio", {"chat": chat_id, "source": source}, round(ok / n, 4) if n else 0
+        for model, (ok, n) in self.model_counts.items():
+            yield "model_accuracy_ratio", {"model": model}, round(ok / n, 4) if n else 0
+        yield "results_learned", {}, self.learned
+        yield "results_pending", {}, len(self._tracked)
+
+    async def handle_update(self, update):
+        # events.Raw handler; Telethon also dispatches the updates our own votes return
+        if isinstance(update, UpdateMessagePoll):
+            self.on_results(update.poll_id, update.results, update.poll)
@@ -0,0 +1,211 @@
+import asyncio
+import gzip
+import io
+import json
+import logging
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for .zst logs
+    zstandard = None
+
+from metrics import trace_sinks
+from quiz_results import poll_text
+
+
+# --------------------- Log Files ---------------------
+# Append-only, one JSON object per line. The compression follows the file
+# extension: ".zst" (needs the zstandard package), ".gz", anything else plain.
+# A writer keeps one compressed member/frame open for its whole run and
+# sync-flushes it, so each flush is readable on its own (a killed process loses
+# at most the records since the last flush) while the compression window is
+# kept. Each run appends a new member; readers go through them in order and
+# skip the torn tail of one that was cut short.
+def open_log(path, mode):
+    # mode "a" to append, "r" to read; text streams either way
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path}: install the zstandard package for .zst logs, or use .gz")
+        if mode == "a":
+            raw = open(path, "ab")
+            stream = zstandard.ZstdCompressor(level=6).stream_writer(raw, closefd=True)
+        else:
+            raw = open(path, "rb")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+_GZIP_MAGIC = b"\x1f\x8b\x08"
+_READ_ERRORS = (EOFError, OSError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+def _find_magic(f, start, chunk_size=1 << 16):
+    # file offset of the next gzip member header at or after `start`, or -1
+    f.seek(start)
+    tail = b""
+    offset = start
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return -1
+        buf = tail + data
+        i = buf.find(_GZIP_MAGIC)
+        if i >= 0:
+            return offset - len(tail) + i
+        tail = buf[-(len(_GZIP_MAGIC) - 1):]
+        offset += len(data)
+
+def _gzip_lines(path, chunk_size=1 << 16):
+    # streamed member by member, so a member cut short (no end marker, or a
+    # later run's header right after the torn bytes) is skipped up to the next
+    # member header instead of failing the whole file
+    with open(path, "rb") as f:
+        pos = 0  # where the current member starts
+        while True:
+            f.seek(pos)
+            d = zlib.decompressobj(wbits=31)
+            pending = b""
+            consumed = 0
+            while not d.eof:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                consumed += len(data)
+                saved = d.copy()
+                try:
+                    out = d.decompress(data)
+                except zlib.error:
+                    # torn: decode this chunk again only up to the next header
+                    end = data.find(_GZIP_MAGIC, 1)
+                    try:
+                        out = saved.decompress(data[:end] if end > 0 else data)
+                    except zlib.error:
+                        out = b""
+                    data = None
+                lines = (pending + out).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    yield line.decode("utf-8", errors="replace")
+                if data is None:
+                    break
+            if consumed == 0:
+                return
+            if d.eof:
+                if pending:
+                    yield pending.decode("utf-8", errors="replace")
+                pos += consumed - len(d.unused_data)
+                continue
+            # truncated or torn: keep the complete lines, drop the last one
+            logging.warning(f"⚠️ {path}: skipped a truncated block in the member at byte {pos}")
+            pos = _find_magic(f, pos + 1)
+            if pos < 0:
+                return
+
+def _stream_lines(path):
+    try:
+        with open_log(path, "r") as f:
+            yield from f
+    except _READ_ERRORS as e:
+        logging.warning(f"⚠️ {path}: stopped at a truncated tail ({e})")
+
+def read_records(path):
+    lines = _gzip_lines(path) if path.endswith(".gz") else _stream_lines(path)
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            logging.warning(f"⚠️ {path}: skipped an incomplete record")
+
+
+# --------------------- Poll Recorder ---------------------
+# Trace sink that keeps the poll stream for offline replay: arrival time,
+# chat, question, options, close timer, the answer and where it came from, and
+# the stage timings. Polls dropped by the queue are recorded too (answer None,
+# source "dropped"), so the log has the real arrival shape. Writes are
+# buffered and flushed at most once per `flush_interval`; records that arrive
+# within the interval are flushed by a timer once it is up, so the end of a
+# burst does not wait for the next poll.
+class PollRecorder:
+    def __init__(self, path, flush_interval=1.0):
+        if path.endswith(".zst") and zstandard is None:
+            # fail at startup, not when the first responder starts
+            raise RuntimeError(f"{path}: install the zstandard package for .zst logs, or use .gz")
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = None
+        self._last_flush = 0.0
+        self._timer = None
+        self.records = 0
+
+    def start(self):
+        # idempotent: several responder loops (accounts) share one log
+        if self._file is not None:
+            return
+        self._file = open_log(self.path, "a")
+        self._last_flush = time.monotonic()
+        trace_sinks.append(self)
+        logging.info(f"📼 Recording polls to {self.path}")
+
+    def __call__(self, trace):
+        message = trace.message
+        if message is None:
+            return
+        poll = message.media.poll
+        now = time.monotonic()
+        close_period = poll.close_period
+        if close_period is None and poll.close_date is not None and message.date is not None:
+            close_period = round((poll.close_date - message.date).total_seconds())
+        record = {
+            "t": round(time.time() - (now - trace.started), 3),  # arrival, wall clock
+            "chat": trace.chat_id,
+            "msg": trace.msg_id,
+            "q": poll_text(poll.question),
+            "o": [poll_text(a.text) for a in poll.answers],
+            "quiz": bool(poll.quiz),
+            "cp": close_period,
+            "a": trace.answer,
+            "src": trace.source or "dropped",
+            "model": trace.model,
+            "st": {k: round(v, 4) for k, v in trace.stages.items()},
+            "tot": round(trace.total, 4),
+        }
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.records += 1
+        if now - self._last_flush >= self.flush_interval:
+            self._flush(now)
+        elif self._timer is None:
+            delay = self._last_flush + self.flush_interval - now
+            self._timer = asyncio.get_running_loop().call_later(delay, self._idle_flush)
+
+    def _idle_flush(self):
+        self._timer = None
+        if self._file is not None:
+            self._flush(time.monotonic())
+
+    def _flush(self, now):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # TextIOWrapper.flush() ends in GzipFile.flush() (Z_SYNC_FLUSH) or the
+        # zstd writer's flush() (FLUSH_BLOCK): the bytes so far decode on their
+        # own, but the member/frame and its window stay open
+        self._file.flush()
+        self._last_flush = now
+
+    def close(self):
+        if self._file is None:
+            return
+        trace_sinks.remove(self)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._file.close()
+        self._file = None
+        logging.info(f"📼 Recorded {self.records} poll(s) to {self.path}")
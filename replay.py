@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from telethon import utils
+from telethon.tl.types import UpdateNewChannelMessage
+
+import config
+import metrics
+from bench import SCRIPTS, STAGES, StubTelegramClient, load_pipeline, make_poll_message, silence_ui, summarize
+from recorder import read_records
+
+# Feeds a poll log written by the recorder (RECORD_POLLS_PATH, or bench.py
+# --record) back through the real handler of either script, with the same stub
+# Telegram client and local answer engine as bench.py, and compares the replay
+# with what was recorded.
+#
+#   python replay.py polls.jsonl.gz --speed 10 --output replay.json
+#
+# --speed 1 keeps the recorded arrival times, 10 plays them ten times faster,
+# 0 sends every poll as fast as possible. Close timers keep their recorded
+# length in seconds. Polls seen by several accounts are replayed once.
+
+
+def load_log(path, limit=None):
+    seen = set()
+    records = []
+    for record in read_records(path):
+        key = (record["chat"], record["msg"])
+        if key in seen:
+            continue
+        seen.add(key)
+        records.append(record)
+    records.sort(key=lambda r: r["t"])
+    return records[:limit] if limit else records
+
+
+def replay_message(n, record):
+    peer_id, peer_type = utils.resolve_id(record["chat"])
+    message = make_poll_message(n, peer_id, record["q"], record["o"], record["cp"])
+    message.peer_id = peer_type(peer_id)
+    message.media.poll.quiz = record["quiz"]
+    return message
+
+
+async def drive(module, client, records, speed):
+    groups = {f"chat{chat}": chat for chat in sorted({r["chat"] for r in records})}
+    traces = []
+    metrics.trace_sinks.append(traces.append)
+    responder = asyncio.create_task(module.responder_loop(client, groups))
+    await client.wait_ready()
+
+    tasks = []
+    first = records[0]["t"]
+    start = time.monotonic()
+    for n, record in enumerate(records, 1):
+        if speed:
+            delay = start + (record["t"] - first) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        message = replay_message(n, record)
+        tasks.extend(client.dispatch(UpdateNewChannelMessage(message, pts=n, pts_count=1)))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    await module.poll_queue.join()
+    elapsed = time.monotonic() - start
+    client.disconnect()
+    await responder
+    metrics.trace_sinks.remove(traces.append)
+    errors = [r for r in results if isinstance(r, Exception)]
+    return traces, elapsed, errors
+
+
+def side(totals, stage_maps, sources):
+    stages = {}
+    for name in STAGES:
+        summary = summarize([s[name] for s in stage_maps if name in s])
+        if summary:
+            stages[name] = summary
+    return {
+        "latency": {"total": summarize(totals), "stages": stages},
+        "sources": dict(Counter(sources)),
+    }
+
+
+def report(args, module, client, records, traces, elapsed, errors):
+    span = records[-1]["t"] - records[0]["t"]
+    replayed = side(
+        [t.total for t in traces],
+        [t.stages for t in traces],
+        [t.source or "dropped" for t in traces],
+    )
+    replayed.update(
+        votes=client.votes,
+        errors=len(errors),
+        elapsed_s=round(elapsed, 3),
+        cache=module.answer_cache.stats(),
+    )
+    return {
+        "script": args.script,
+        "log": args.log,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "params": {
+            "speed": args.speed,
+            "engine_latency": args.engine_latency,
+            "engine_jitter": args.engine_jitter,
+            "vote_latency": args.vote_latency,
+            "answer_speed": args.answer_speed,
+        },
+        "polls": len(records),
+        "groups": len({r["chat"] for r in records}),
+        "recorded_span_s": round(span, 3),
+        "recorded": side([r["tot"] for r in records], [r["st"] for r in records], [r["src"] for r in records]),
+        "replayed": replayed,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded poll log through the pipeline with stubbed Telegram")
+    parser.add_argument("log", help="poll log (.jsonl, .jsonl.gz or .jsonl.zst)")
+    parser.add_argument("--script", choices=SCRIPTS, default="single")
+    parser.add_argument("--speed", type=float, default=1.0, help="arrival speed-up (1 = real time, 0 = no waiting)")
+    parser.add_argument("--limit", type=int, help="replay only the first N polls")
+    parser.add_argument("--engine-latency", type=float, default=0.05)
+    parser.add_argument("--engine-jitter", type=float, default=0.02)
+    parser.add_argument("--vote-latency", type=float, default=0.03)
+    parser.add_argument("--answer-speed", choices=list(config.SPEED_DELAY), default=config.ANSWER_SPEED)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+async def run_replay(args):
+    records = load_log(args.log, args.limit)
+    if not records:
+        raise SystemExit(f"{args.log}: no polls recorded")
+    module = load_pipeline(args.script, tempfile.mkdtemp(prefix="replay-"), {
+        "LOCAL_ENGINE_LATENCY": args.engine_latency,
+        "LOCAL_ENGINE_JITTER": args.engine_jitter,
+        "LOCAL_ENGINE_SEED": args.seed,
+        "ANSWER_SPEED": args.answer_speed,
+        "RECORD_POLLS_PATH": None,
+    })
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    silence_ui(module)
+    client = StubTelegramClient(args.vote_latency)
+    traces, elapsed, errors = await drive(module, client, records, args.speed)
+    return report(args, module, client, records, traces, elapsed, errors)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run_replay(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
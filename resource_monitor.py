@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import sys
+import tracemalloc
+from collections import deque
+
+try:
+    import psutil
+except ImportError:  # optional: RSS where there is no /proc
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+
+# --------------------- Process Readings ---------------------
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+_rss_source = None
+
+def _proc_rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * _PAGE_SIZE
+
+def _psutil_rss():
+    return psutil.Process().memory_info().rss
+
+def _peak_rss():
+    # peak, not current, RSS: it only rises, but a leak still keeps raising it
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+def rss_bytes():
+    # resident set size from /proc, psutil or getrusage (first that works,
+    # remembered); None, logged once, when none of them is available
+    global _rss_source
+    if _rss_source is None:
+        candidates = [("/proc", _proc_rss)]
+        if psutil is not None:
+            candidates.append(("psutil", _psutil_rss))
+        if resource is not None:
+            candidates.append(("getrusage peak", _peak_rss))
+        for name, read in candidates:
+            try:
+                value = read()
+            except Exception:
+                continue
+            _rss_source = (name, read)
+            return value
+        _rss_source = ("unavailable", None)
+        logging.warning("⚠️ RSS unavailable on this platform (no /proc, psutil or getrusage); not sampled")
+    read = _rss_source[1]
+    if read is None:
+        return None
+    try:
+        return read()
+    except Exception:
+        return None
+
+def rss_source():
+    rss_bytes()
+    return _rss_source[0]
+
+def _task_count():
+    try:
+        return len(asyncio.all_tasks())
+    except RuntimeError:  # no running loop
+        return None
+
+
+def slope(points):
+    # least-squares slope of [(t, value)], per second
+    n = len(points)
+    if n < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / var
+
+
+# --------------------- Resource Sampler ---------------------
+# Periodically records RSS, live asyncio tasks, threads and (when tracemalloc
+# is on) traced Python memory, keeping the last `history` samples. Exported as
+# process_* gauges, including the growth per hour fitted over that history, so
+# a slow leak shows up on the metrics endpoint long before the process runs out
+# of memory. soak.py runs the same sampler and fails on upward trends.
+FIELDS = ("rss_bytes", "asyncio_tasks", "threads", "traced_bytes")
+
+
+class ResourceSampler:
+    def __init__(self, interval=60.0, history=120, trace_frames=0):
+        self.interval = interval
+        self.samples = deque(maxlen=history)  # (monotonic, {field: value})
+        self.trace_frames = trace_frames
+        self.started = time.monotonic()
+
+    def start_tracing(self):
+        # tracemalloc costs CPU and memory on every allocation, so it is opt-in
+        if self.trace_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+            logging.info(f"🔬 tracemalloc on ({self.trace_frames} frame(s) per allocation)")
+
+    def sample(self):
+        values = {
+            "rss_bytes": rss_bytes(),
+            "asyncio_tasks": _task_count(),
+            "threads": threading.active_count(),
+            "traced_bytes": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+        }
+        values = {k: v for k, v in values.items() if v is not None}
+        self.samples.append((time.monotonic(), values))
+        return values
+
+    async def run(self):
+        self.start_tracing()
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def series(self, field, since=None):
+        return [(t, v[field]) for t, v in self.samples if field in v and (since is None or t >= since)]
+
+    def growth_per_hour(self, field, since=None):
+        return slope(self.series(field, since)) * 3600
+
+    def stats(self):
+        if not self.samples:
+            return {}
+        stats = dict(self.samples[-1][1])
+        if len(self.samples) >= 3:
+            for field in FIELDS:
+                if field in stats:
+                    stats[f"{field}_per_hour"] = round(self.growth_per_hour(field), 3)
+        stats["uptime_seconds"] = round(time.monotonic() - self.started, 1)
+        return stats
+
+
+# --------------------- Allocators ---------------------
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+def take_snapshot():
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+def top_allocators(snapshot, base=None, limit=10):
+    # largest allocation sites, or largest growth since `base`
+    if snapshot is None:
+        return []
+    if base is not None:
+        stats = snapshot.compare_to(base, "lineno")
+        return [
+            {"where": str(s.traceback), "size_kib": round(s.size / 1024, 1),
+             "growth_kib": round(s.size_diff / 1024, 1), "count": s.count, "count_growth": s.count_diff}
+            for s in stats[:limit]
+        ]
+    return [
+        {"where": str(s.traceback), "size_kib": round(s.size / 1024, 1), "count": s.count}
+        for s in snapshot.statistics("lineno")[:limit]
+    ]
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import runpy
+
+import config
+
+
+class ConfigError(ValueError):
+    pass
+
+
+# --------------------- Validators ---------------------
+def _bool(name, value):
+    if not isinstance(value, bool):
+        raise ConfigError(f"{name} must be True or False")
+    return value
+
+def _number(low=None, high=None):
+    def check(name, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ConfigError(f"{name} must be a number")
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise ConfigError(f"{name} must be between {low} and {high}")
+        return value
+    return check
+
+def _text(name, value):
+    if not isinstance(value, str) or not value.strip():
+        raise ConfigError(f"{name} must be a non-empty string")
+    return value
+
+def _text_list(allow_empty=False):
+    def check(name, value):
+        if not isinstance(value, (list, tuple)) or not all(isinstance(v, str) and v.strip() for v in value):
+            raise ConfigError(f"{name} must be a list of non-empty strings")
+        if not value and not allow_empty:
+            raise ConfigError(f"{name} must not be empty")
+        return tuple(value)
+    return check
+
+def _speed_table(name, value):
+    if not isinstance(value, dict) or not value:
+        raise ConfigError(f"{name} must be a non-empty dict of speed -> seconds")
+    for speed, delay in value.items():
+        _number(0)(f"{name}[{speed!r}]", delay)
+    return dict(value)
+
+
+# --------------------- Runtime Settings ---------------------
+# The settings that can change while the client runs. Everything else in
+# config.py is read once at startup; edits to those are logged and need a
+# restart.
+RELOADABLE = {
+    "ANSWER_SPEED": _text,
+    "SPEED_DELAY": _speed_table,
+    "FAST_MODE": _bool,
+    "AUTO_TICK": _bool,
+    "TARGET_GROUPS": _text_list(),
+    "GEMINI_API_KEYS": _text_list(),
+    "GEMINI_MODEL": _text,
+    "GEMINI_MODEL_TIERS": _text_list(allow_empty=True),
+    "CASCADE_MIN_CONFIDENCE": _number(0, 1),
+}
+SECRET = {"GEMINI_API_KEYS"}
+
+
+class RuntimeSettings:
+    __slots__ = tuple(RELOADABLE)
+
+    def __init__(self, values):
+        problems = []
+        for name, check in RELOADABLE.items():
+            try:
+                if name not in values:
+                    raise ConfigError(f"{name} is missing")
+                setattr(self, name, check(name, values[name]))
+            except ConfigError as e:
+                problems.append(str(e))
+        if not problems and self.ANSWER_SPEED not in self.SPEED_DELAY:
+            problems.append(f"ANSWER_SPEED {self.ANSWER_SPEED!r} is not one of {sorted(self.SPEED_DELAY)}")
+        if problems:
+            raise ConfigError("; ".join(problems))
+
+    @classmethod
+    def from_module(cls, module):
+        return cls({name: getattr(module, name) for name in RELOADABLE if hasattr(module, name)})
+
+    def diff(self, other):
+        # names whose value differs in `other`
+        return [name for name in RELOADABLE if getattr(self, name) != getattr(other, name)]
+
+
+def _describe(name, value):
+    if name in SECRET:
+        return f"{len(value)} key(s)"
+    return repr(list(value) if isinstance(value, tuple) else value)
+
+
+# --------------------- Config Watcher ---------------------
+# Polls config.py for changes. A changed file is executed in a fresh namespace
+# and validated as a whole; if anything is wrong the running settings stay as
+# they are. Otherwise every changed value is set on the `config` module in one
+# step (no await in between, so a poll never sees half a reload) and listeners
+# are called with the names that changed. Modules read reloadable settings as
+# config.NAME at use time instead of copying them at import.
+class ConfigWatcher:
+    def __init__(self, path, interval=2.0):
+        self.path = path
+        self.interval = interval
+        self.settings = RuntimeSettings.from_module(config)
+        self.listeners = []  # fn(changed names), may be a coroutine function
+        self.reloads = 0
+        self.errors = 0
+        self._mtime = self._stat()
+        self._other = self._static_values(vars(config))
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _static_values(namespace):
+        return {
+            k: v for k, v in namespace.items()
+            if k.isupper() and k not in RELOADABLE and isinstance(v, (bool, int, float, str, list, tuple, dict, type(None)))
+        }
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self._stat()
+            if mtime is None or mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            await self.reload()
+
+    async def reload(self):
+        try:
+            namespace = await asyncio.to_thread(runpy.run_path, self.path)
+            settings = RuntimeSettings(namespace)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"❌ Config reload rejected, keeping current settings: {e}")
+            return []
+
+        changed = self.settings.diff(settings)
+        for name in changed:
+            logging.info(
+                f"🔧 {name}: {_describe(name, getattr(self.settings, name))} → {_describe(name, getattr(settings, name))}"
+            )
+            setattr(config, name, getattr(settings, name))
+        self.settings = settings
+
+        other = self._static_values(namespace)
+        for name in sorted(set(other) | set(self._other)):
+            if other.get(name) != self._other.get(name):
+                logging.warning(f"⚠️ {name} changed in {os.path.basename(self.path)}; restart to apply it")
+        self._other = other
+
+        if not changed:
+            return []
+        self.reloads += 1
+        for listener in self.listeners:
+            try:
+                result = listener(changed)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logging.error(f"❌ Applying {', '.join(changed)} failed: {e}")
+        return changed
+
+    def stats(self):
+        return {"reloads": self.reloads, "rejected": self.errors}
@@ -0,0 +1,165 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from metrics import activate_trace, inc, observe
+
+
+class _Job:
+    __slots__ = ("group", "deadline", "trace", "run", "enqueued")
+
+    def __init__(self, group, deadline, trace, run):
+        self.group = group
+        self.deadline = deadline
+        self.trace = trace
+        self.run = run
+        self.enqueued = time.monotonic()
+
+
+# --------------------- Poll Queue ---------------------
+# The Telethon handler only filters and enqueues; a fixed pool of workers does
+# the answering and voting. Groups are served round-robin (earliest deadline
+# first inside a group), so a flood in one group cannot starve the others, and
+# the queue is bounded: when full, the group with the most waiting polls loses
+# its oldest ("oldest") or newest ("newest") one, which may be the incoming
+# poll itself. Polls that closed while queued are dropped when they reach a
+# worker.
+class PollQueue:
+    def __init__(self, workers=16, max_size=200, drop_policy="oldest"):
+        if drop_policy not in ("oldest", "newest"):
+            raise ValueError(f"Unknown QUEUE_DROP_POLICY: {drop_policy}")
+        self.workers = workers
+        self.max_size = max_size
+        self.drop_policy = drop_policy
+        self._groups = OrderedDict()  # group -> heap of (deadline, seq, job), in serving order
+        self._seq = itertools.count()
+        self._size = 0
+        self._unfinished = 0
+        self._ready = None
+        self._idle = None
+        self._tasks = []
+        self.busy = 0
+        self.processed = 0
+        self.dropped = 0
+
+    def start(self):
+        # idempotent: several responder loops (accounts) share one pool
+        if self._tasks:
+            return
+        self._ready = asyncio.Semaphore(0)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logging.info(f"🧵 Poll queue started ({self.workers} workers, max {self.max_size} queued, drop {self.drop_policy})")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, group, deadline, trace, run):
+        # returns False if the poll was rejected; `run` is a coroutine function
+        if self._size >= self.max_size:
+            # the busiest group pays, counting the incoming poll as its own
+            sizes = {g: len(heap) for g, heap in self._groups.items()}
+            sizes[group] = sizes.get(group, 0) + 1
+            busiest = max(sizes, key=sizes.get)
+            if busiest == group and (self.drop_policy == "newest" or group not in self._groups):
+                self._drop(_Job(group, deadline, trace, run), "queue_full")
+                return False
+            self._drop(self._pop(busiest, newest=self.drop_policy == "newest"), "queue_full")
+
+        job = _Job(group, deadline, trace, run)
+        heap = self._groups.get(group)
+        if heap is None:
+            heap = self._groups[group] = []
+        heapq.heappush(heap, (math.inf if deadline is None else deadline, next(self._seq), job))
+        self._size += 1
+        self._unfinished += 1
+        self._idle.clear()
+        self._ready.release()
+        return True
+
+    def _pop(self, group, newest=False):
+        heap = self._groups[group]
+        pick = max if newest else min
+        i = pick(range(len(heap)), key=lambda i: heap[i][1])
+        job = heap[i][2]
+        heap[i] = heap[-1]
+        heap.pop()
+        heapq.heapify(heap)
+        if not heap:
+            del self._groups[group]
+        self._size -= 1
+        self._unfinished -= 1
+        return job
+
+    def _drop(self, job, reason):
+        self.dropped += 1
+        inc("polls_dropped_total", reason=reason)
+        logging.warning(f"🚮 Dropped poll from {job.group} ({reason})")
+        job.trace.finish()
+        self._check_idle()
+
+    def _next(self):
+        group, heap = next(iter(self._groups.items()))
+        _, _, job = heapq.heappop(heap)
+        if heap:
+            self._groups.move_to_end(group)  # round-robin: next group goes first
+        else:
+            del self._groups[group]
+        self._size -= 1
+        return job
+
+    def _check_idle(self):
+        if self._unfinished == 0:
+            self._idle.set()
+
+    async def _worker(self, n):
+        while True:
+            await self._ready.acquire()
+            if not self._size:
+                continue  # its poll was dropped to make room
+            job = self._next()
+            wait = time.monotonic() - job.enqueued
+            observe("queue_wait_seconds", wait)
+            job.trace.stages["queue"] = wait
+            try:
+                if job.deadline is not None and time.monotonic() >= job.deadline:
+                    inc("deadline_misses_total", stage="queue")
+                    inc("polls_dropped_total", reason="expired")
+                    self.dropped += 1
+                    job.trace.finish()
+                    continue
+                self.busy += 1
+                activate_trace(job.trace)
+                try:
+                    await job.run()
+                except Exception as e:
+                    logging.error(f"Poll worker error: {e}")
+                finally:
+                    self.busy -= 1
+                    self.processed += 1
+            finally:
+                self._unfinished -= 1
+                self._check_idle()
+
+    async def join(self):
+        # wait until every accepted poll has been answered or dropped
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def stats(self):
+        return {
+            "depth": self._size,
+            "groups_waiting": len(self._groups),
+            "busy_workers": self.busy,
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
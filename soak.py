@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from telethon import utils
+from telethon.tl.types import PeerChannel, UpdateNewChannelMessage
+
+import config
+from bench import (
+    SCRIPTS, StubTelegramClient, load_pipeline, make_poll_message, make_text_message, reveal, silence_ui,
+    synthetic_polls,
+)
+from resource_monitor import ResourceSampler, rss_source, slope, take_snapshot, top_allocators
+
+# Runs either script's responder_loop for a long time against synthetic poll
+# traffic (stub Telegram client, local answer engine, as in bench.py) and
+# samples RSS, live asyncio tasks, threads and tracemalloc over the run. After
+# the warm-up, a least-squares line is fitted to each series; the run fails
+# (exit status 1) if any of them grows by more than its allowance.
+#
+#   python soak.py --duration 3600 --rate 5 --output soak.json
+#
+# Bounded caches are shrunk to --bound entries so they fill up during the
+# warm-up; after that, memory should stay flat.
+
+# field -> (absolute, relative) growth allowed over the measured part of the run
+ALLOWED_GROWTH = {
+    "rss_bytes": (16 * 2**20, 0.10),
+    "traced_bytes": (4 * 2**20, 0.10),
+    "asyncio_tasks": (5, 0.0),
+    "threads": (2, 0.0),
+}
+
+
+async def drive(module, client, groups, polls, args, sampler):
+    rng = random.Random(args.seed)
+    chatter_ids = itertools.count(10**6)
+    pending = set()
+    errors = 0
+
+    def finished(task):
+        nonlocal errors
+        pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            errors += 1
+
+    def spawn(tasks):
+        # keep only what is still running, so the driver itself does not grow
+        for task in tasks:
+            pending.add(task)
+            task.add_done_callback(finished)
+
+    responder = asyncio.create_task(module.responder_loop(client, groups))
+    await client.wait_ready()
+    sampling = asyncio.create_task(sampler.run())
+
+    start = time.monotonic()
+    warm_at = start + args.duration * args.warmup
+    baseline = None
+    next_report = start + args.duration / 10
+    next_at = start
+    sent = 0
+    for msg_id, channel_id, question, options in polls:
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        now = time.monotonic()
+        if baseline is None and now >= warm_at:
+            baseline = take_snapshot()
+        if now >= next_report:
+            last = sampler.samples[-1][1] if sampler.samples else {}
+            rss = f"{last['rss_bytes'] / 2**20:.1f} MiB" if "rss_bytes" in last else "n/a"
+            print(
+                f"soak: {now - start:.0f}s, {sent} polls, rss {rss}, "
+                f"{last.get('asyncio_tasks')} tasks, {last.get('threads')} threads",
+                file=sys.stderr,
+            )
+            next_report += args.duration / 10
+        for n in range(args.chatter):
+            text = make_text_message(next(chatter_ids), 2_000_000 + n % 50, "just chatting")
+            spawn(client.dispatch(UpdateNewChannelMessage(text, pts=0, pts_count=1)))
+        close_period = rng.choice(args.close_period) if args.close_period else None
+        message = make_poll_message(msg_id, channel_id, question, options, close_period)
+        spawn(client.dispatch(UpdateNewChannelMessage(message, pts=msg_id, pts_count=1)))
+        if args.reveal_after is not None:
+            spawn([asyncio.create_task(reveal(client, message, args.reveal_after))])
+        sent += 1
+        next_at += 1.0 / args.rate
+
+    await asyncio.gather(*pending, return_exceptions=True)
+    await module.poll_queue.join()
+    elapsed = time.monotonic() - start
+    sampler.sample()
+    final = take_snapshot()
+    sampling.cancel()
+    client.disconnect()
+    await responder
+    return {
+        "polls": sent,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 1),
+        "warm_at": warm_at,
+        "baseline": baseline,
+        "final": final,
+    }
+
+
+def trends(sampler, since):
+    result = {}
+    for field, (absolute, relative) in ALLOWED_GROWTH.items():
+        points = sampler.series(field, since)
+        if len(points) < 3:
+            continue
+        span = points[-1][0] - points[0][0]
+        growth = slope(points) * span
+        allowed = max(absolute, relative * points[0][1])
+        result[field] = {
+            "first": points[0][1],
+            "last": points[-1][1],
+            "peak": max(v for _, v in points),
+            "growth": round(growth, 1),
+            "allowed": round(allowed, 1),
+            "per_hour": round(slope(points) * 3600, 1),
+            "leaking": growth > allowed,
+        }
+    return result
+
+
+def report(args, module, client, run, sampler):
+    fitted = trends(sampler, run["warm_at"])
+    leaking = sorted(field for field, t in fitted.items() if t["leaking"])
+    # not measured: neither passed nor failed
+    skipped = {
+        field: "not sampled" if not sampler.series(field) else "fewer than 3 samples after the warm-up"
+        for field in ALLOWED_GROWTH if field not in fitted
+    }
+    if "rss_bytes" in skipped and rss_source() == "unavailable":
+        skipped["rss_bytes"] = "RSS unavailable on this platform"
+    if "traced_bytes" in skipped and not args.trace_frames:
+        skipped["traced_bytes"] = "tracemalloc off"
+    start = sampler.samples[0][0] if sampler.samples else 0.0
+    return {
+        "script": args.script,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "params": {
+            "duration": args.duration,
+            "rate": args.rate,
+            "groups": args.groups,
+            "repeat_ratio": args.repeat_ratio,
+            "chatter": args.chatter,
+            "reveal_after": args.reveal_after,
+            "close_period": args.close_period,
+            "bound": args.bound,
+            "warmup": args.warmup,
+            "sample_interval": sampler.interval,
+            "trace_frames": args.trace_frames,
+            "rss_source": rss_source(),
+        },
+        "polls": run["polls"],
+        "votes": client.votes,
+        "errors": run["errors"],
+        "elapsed_s": run["elapsed_s"],
+        "cache": module.answer_cache.stats(),
+        "queue": module.poll_queue.stats(),
+        "console": module.start_console(config.HEADLESS, config.UI_FLUSH_INTERVAL).stats(),
+        "trends": fitted,
+        "leaking": leaking,
+        "skipped": skipped,
+        "passed": not leaking and run["errors"] == 0,
+        # growth per allocation site between the end of the warm-up and the end of the run
+        "top_allocators": top_allocators(run["final"], run["baseline"], args.top),
+        "samples": [
+            {"t": round(t - start, 1), **values} for t, values in sampler.samples
+        ],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Soak-test the responder and fail on growing memory, tasks or threads")
+    parser.add_argument("--script", choices=SCRIPTS, default="single")
+    parser.add_argument("--duration", type=float, default=3600, help="seconds of traffic")
+    parser.add_argument("--rate", type=float, default=5.0, help="polls per second")
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3)
+    parser.add_argument("--chatter", type=int, default=5, help="ordinary messages before every poll")
+    parser.add_argument("--reveal-after", type=float, default=0.5, help="reveal each quiz answer after this many seconds")
+    parser.add_argument("--close-period", type=int, nargs="+", help="random close timers (seconds)")
+    parser.add_argument("--bound", type=int, default=500, help="entries kept by the answer cache and quiz tracking")
+    parser.add_argument("--warmup", type=float, default=0.25, help="share of the run ignored by the trend check")
+    parser.add_argument("--sample-interval", type=float, help="seconds between samples (default duration / 120)")
+    parser.add_argument("--trace-frames", type=int, default=1, help="tracemalloc frames per allocation (0 = off)")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites in the report")
+    parser.add_argument("--engine-latency", type=float, default=0.05)
+    parser.add_argument("--engine-jitter", type=float, default=0.02)
+    parser.add_argument("--vote-latency", type=float, default=0.03)
+    parser.add_argument("--answer-speed", choices=list(config.SPEED_DELAY), default="instant")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+async def run_soak(args):
+    module = load_pipeline(args.script, tempfile.mkdtemp(prefix="soak-"), {
+        "LOCAL_ENGINE_LATENCY": args.engine_latency,
+        "LOCAL_ENGINE_JITTER": args.engine_jitter,
+        "LOCAL_ENGINE_SEED": args.seed,
+        "ANSWER_SPEED": args.answer_speed,
+        "ANSWER_CACHE_SIZE": args.bound,
+        "RECORD_POLLS_PATH": None,
+    })
+    module.quiz_results.max_tracked = args.bound
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    silence_ui(module)
+
+    interval = args.sample_interval or max(1.0, args.duration / 120)
+    sampler = ResourceSampler(interval, history=int(args.duration / interval) + 10, trace_frames=args.trace_frames)
+    channel_ids = [1_000_000 + i for i in range(args.groups)]
+    groups = {f"soak{i}": utils.get_peer_id(PeerChannel(cid)) for i, cid in enumerate(channel_ids)}
+    client = StubTelegramClient(args.vote_latency)
+    polls = synthetic_polls(
+        int(args.duration * args.rate), channel_ids, args.repeat_ratio, seed=args.seed, max_seen=args.bound,
+    )
+    run = await drive(module, client, groups, polls, args, sampler)
+    return report(args, module, client, run, sampler)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run_soak(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for field in result["leaking"]:
+        t = result["trends"][field]
+        print(f"soak: {field} grew by {t['growth']} (allowed {t['allowed']})", file=sys.stderr)
+    for field, reason in result["skipped"].items():
+        print(f"soak: {field} check skipped ({reason})", file=sys.stderr)
+    if result["errors"]:
+        print(f"soak: {result['errors']} handler task(s) failed", file=sys.stderr)
+    print(f"soak: {'PASS' if result['passed'] else 'FAIL'}", file=sys.stderr)
+    if not result["passed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+from telethon import utils
+from telethon.tl.types import MessageMediaPoll, UpdateNewChannelMessage, UpdateNewMessage
+
+# Raw updates that can carry a new poll; register with
+#   client.add_event_handler(handler, events.Raw(types=POLL_UPDATES))
+# so Telethon skips building NewMessage events (entity lookups, event objects)
+# for the chat traffic that is not a poll in a target group.
+POLL_UPDATES = (UpdateNewChannelMessage, UpdateNewMessage)
+
+
+def poll_message(update, chat_ids):
+    # (message, chat_id) for a poll posted in one of chat_ids, else None;
+    # the media check goes first since almost nothing is a poll
+    message = update.message
+    if type(getattr(message, "media", None)) is not MessageMediaPoll:
+        return None
+    chat_id = utils.get_peer_id(message.peer_id)
+    if chat_id not in chat_ids:
+        return None
+    return message, chat_id
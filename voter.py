@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from telethon import errors, utils
+from telethon.tl.functions.messages import SendVoteRequest
+
+from metrics import inc, observe
+
+
+# --------------------- Voter ---------------------
+# One per Telegram client. Target groups are resolved to InputPeers at startup
+# so SendVoteRequest goes out without a session/entity lookup, and Telethon's
+# typed errors map to explicit outcomes:
+#   ok, already_voted, closed, flood_wait, invalid_option, forbidden, failed
+# Only a short flood wait or a dropped connection is retried, once; a poll that
+# was already voted on (duplicate update, second handler) is not re-sent.
+class Voter:
+    def __init__(self, client, flood_max_wait=3, max_remembered=2000):
+        self.client = client
+        self.flood_max_wait = flood_max_wait
+        self.max_remembered = max_remembered
+        self.peers = {}             # peer id -> InputPeer
+        self._voted = OrderedDict()  # (peer id, msg id) -> outcome
+        self._tasks = set()          # background peer lookups; the loop only keeps weak references
+
+    async def prepare(self, peer_ids):
+        start = time.monotonic()
+        for peer_id in peer_ids:
+            try:
+                self.peers[peer_id] = await self.client.get_input_entity(peer_id)
+            except (ValueError, errors.RPCError) as e:
+                logging.warning(f"⚠️ Could not pre-resolve peer {peer_id}: {e}")
+        logging.info(f"🎯 Pre-resolved {len(self.peers)} vote peer(s) in {time.monotonic() - start:.2f}s")
+
+    def _input_peer(self, message):
+        peer_id = utils.get_peer_id(message.peer_id)
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            # unseen group (e.g. added by a background refresh): Telethon
+            # resolves it this time, and it is pre-resolved after the vote
+            return message.peer_id, peer_id
+        return peer, peer_id
+
+    async def _learn_peer(self, peer_id, peer):
+        try:
+            self.peers[peer_id] = await self.client.get_input_entity(peer)
+        except (ValueError, errors.RPCError):
+            pass
+
+    def _finished(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(f"⚠️ Could not pre-resolve a vote peer: {task.exception()!r}")
+
+    def _remember(self, key, outcome):
+        self._voted[key] = outcome
+        while len(self._voted) > self.max_remembered:
+            self._voted.popitem(last=False)
+
+    async def _send(self, peer, message, option):
+        start = time.monotonic()
+        try:
+            await self.client(SendVoteRequest(peer=peer, msg_id=message.id, options=[option]))
+        finally:
+            observe("vote_rpc_seconds", time.monotonic() - start)
+
+    async def vote(self, message, option_index):
+        peer, peer_id = self._input_peer(message)
+        key = (peer_id, message.id)
+        if self._voted.get(key) in ("pending", "ok", "already_voted", "closed", "forbidden"):
+            inc("votes_total", outcome="duplicate")
+            return "duplicate"
+        self._remember(key, "pending")
+
+        option = message.media.poll.answers[option_index].option
+        outcome = await self._attempt(peer, message, option, retry=True)
+        if outcome == "ok":
+            logging.info(f"✅ Auto-voted for option {option_index + 1}")
+        if peer_id not in self.peers:
+            task = asyncio.ensure_future(self._learn_peer(peer_id, message.peer_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._finished)
+        self._remember(key, outcome)
+        inc("votes_total", outcome=outcome)
+        return outcome
+
+    async def _attempt(self, peer, message, option, retry):
+        try:
+            await self._send(peer, message, option)
+            return "ok"
+        except errors.RevoteNotAllowedError:
+            logging.info("ℹ️ Already voted in this poll")
+            return "already_voted"
+        except errors.MessagePollClosedError:
+            logging.warning("⚠️ Poll closed before voting could complete.")
+            return "closed"
+        except errors.PollOptionInvalidError:
+            logging.error("❌ Vote rejected: invalid poll option")
+            return "invalid_option"
+        except (errors.ChatWriteForbiddenError, errors.ChannelPrivateError, errors.UserBannedInChannelError) as e:
+            logging.error(f"❌ Not allowed to vote here: {e}")
+            return "forbidden"
+        except errors.FloodWaitError as e:
+            if retry and e.seconds <= self.flood_max_wait:
+                logging.warning(f"⏳ Flood wait {e.seconds}s before voting, retrying")
+                await asyncio.sleep(e.seconds)
+                return await self._attempt(peer, message, option, retry=False)
+            logging.warning(f"⚠️ Vote dropped: flood wait {e.seconds}s")
+            return "flood_wait"
+        except errors.RPCError as e:
+            logging.error(f"❌ Voting failed: {e}")
+            return "failed"
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            if retry:
+                logging.warning(f"⚠️ Vote interrupted ({e}), retrying once")
+                return await self._attempt(peer, message, option, retry=False)
+            logging.error(f"❌ Voting failed: {e}")
+            return "failed"
+        except Exception as e:
+            logging.error(f"❌ Voting failed: {e}")
+            return "failed"